@@ -0,0 +1,259 @@
+import io
+import posixpath
+import sndhdr
+import tarfile
+import zipfile
+from audio import (AU_HEADER_SIZE, au_duration,
+        check_header, sndhdr_duration
+)
+from discovery import INSTANCE_REGEXP
+from hashing import BUFFER_SIZE, HashEngine, new_hash
+from scanner import LogScanner
+
+# sndhdr looks at this many leading bytes of a file
+SNDHDR_SIZE = 512
+
+def sniff_audio(header, size):
+    """
+    Return (is_audio, duration) for a file from its leading bytes and
+    size, as AudioValidator.inspect would decide for the file on disk.
+
+    """
+
+    verdict = check_header(header[:AU_HEADER_SIZE])
+    if verdict is not None:
+        duration = None
+        if verdict and len(header) >= AU_HEADER_SIZE:
+            duration = au_duration(header[:AU_HEADER_SIZE], size)
+        return verdict, duration
+
+    fp = io.BytesIO(header)
+    for test in sndhdr.tests:
+        try:
+            info = test(header, fp)
+        except Exception:
+            continue
+        if info:
+            return True, sndhdr_duration(info)
+    return False, None
+
+def split_lines(chunks):
+    """
+    Yield the lines (with their newlines) contained in a stream of chunks.
+
+    """
+
+    rest = b''
+    for chunk in chunks:
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if rest:
+        yield rest
+
+class ArchiveReader(object):
+    '''
+    Class that reads instances straight out of a .tar(.gz) or .zip
+    archive. Each member is read once, in archive order: its digest is
+    computed as it streams past, logs and text files are parsed from the
+    same bytes, and only the header of every other file is kept.
+
+    '''
+
+    def __init__(self, archive_path, algorithm='sha1', accept=None):
+        self.accept = accept
+        self.algorithm = algorithm
+        self.archive_path = archive_path
+        # only combines digests, so it never starts its thread pool
+        self.hasher = HashEngine(algorithm, threads=1)
+        self.scanner = LogScanner()
+
+        self.audio = {}
+        self.computers = {}
+        self.digests = {}
+        self.dirs = set()
+        self.scans = {}
+        self._accepted = {}
+        self._children = None
+
+    def members(self):
+        """
+        Yield (name, file object) for every regular file in the archive,
+        recording directory entries as they pass.
+
+        """
+
+        if zipfile.is_zipfile(self.archive_path):
+            with zipfile.ZipFile(self.archive_path) as archive:
+                for info in archive.infolist():
+                    name = posixpath.normpath(info.filename.lstrip('/'))
+                    if info.filename.endswith('/'):
+                        self.dirs.add(name)
+                        continue
+                    fp = archive.open(info)
+                    try:
+                        yield name, fp
+                    finally:
+                        fp.close()
+            return
+
+        # stream mode decompresses the archive exactly once
+        archive = tarfile.open(self.archive_path, 'r|*')
+        try:
+            for info in archive:
+                name = posixpath.normpath(info.name.lstrip('/'))
+                if info.isdir():
+                    self.dirs.add(name)
+                elif info.isfile():
+                    yield name, archive.extractfile(info)
+        finally:
+            archive.close()
+
+    def instance_of(self, name):
+        """
+        Return the instance directory a member belongs to (as a file
+        inside it, or as its .txt or log), or None.
+
+        """
+
+        parts = name.split('/')
+        for n, part in enumerate(parts):
+            res = INSTANCE_REGEXP.search(part)
+            if res is not None:
+                return '/'.join(parts[:n] + [part[:res.end()]])
+        return None
+
+    def wanted(self, name):
+        """
+        Return True if a member is part of an instance worth reading.
+
+        """
+
+        instance = self.instance_of(name)
+        if instance is None or '000000' in instance:
+            return False
+        if self.accept is None:
+            return True
+        if instance not in self._accepted:
+            self._accepted[instance] = self.accept(self.archive_path+'/'+instance)
+        return self._accepted[instance]
+
+    def read(self):
+        """
+        Read every member of the archive that belongs to an instance.
+
+        """
+
+        for name, fp in self.members():
+            parent = posixpath.dirname(name)
+            while parent and parent not in self.dirs:
+                self.dirs.add(parent)
+                parent = posixpath.dirname(parent)
+            if not self.wanted(name):
+                continue
+
+            digest = new_hash(self.algorithm)
+            chunks = self.hashed(fp, digest)
+            if name.endswith('.txt'):
+                self.computers[name] = self.scanner.scan_text_lines(split_lines(chunks))
+            elif '.log' in name and '.lck' not in name:
+                self.scans[name] = self.scanner.scan_lines(split_lines(chunks))
+            else:
+                header = b''
+                size = 0
+                for chunk in chunks:
+                    if len(header) < SNDHDR_SIZE:
+                        header += chunk[:SNDHDR_SIZE-len(header)]
+                    size += len(chunk)
+                self.audio[name] = sniff_audio(header, size) + (size,)
+            # drain anything a parser left unread so the digest is complete
+            for chunk in chunks:
+                pass
+            self.digests[name] = digest.hexdigest()
+
+    def hashed(self, fp, digest):
+        for chunk in iter(lambda: fp.read(BUFFER_SIZE), b""):
+            digest.update(chunk)
+            yield chunk
+
+    @property
+    def children(self):
+        # map each directory to the (files, dirs) directly inside it
+        if self._children is None:
+            self._children = {}
+            for name in self.digests:
+                self._children.setdefault(posixpath.dirname(name), ([], []))[0].append(name)
+            for name in self.dirs:
+                self._children.setdefault(posixpath.dirname(name), ([], []))[1].append(name)
+        return self._children
+
+    def instances(self):
+        """
+        Return the sorted instance directories in the archive that have
+        both a .txt and at least one log member.
+
+        """
+
+        found = []
+        for name in self.dirs:
+            if self.instance_of(name) != name or '000000' in name:
+                continue
+            if name+'.txt' in self.computers and self.logs(name):
+                found.append(name)
+        return sorted(found)
+
+    def logs(self, instance):
+        """
+        Return the log members of an instance, matching Processor.get_logs.
+
+        """
+
+        files = self.children.get(posixpath.dirname(instance), ([], []))[0]
+        return sorted(name for name in files
+                      if name.startswith(instance) and name in self.scans)
+
+    def hash_dir(self, dir_name):
+        """
+        Return the value HashEngine.hash_dir gives for the directory
+        once extracted.
+
+        """
+
+        files, dirs = self.children.get(dir_name, ([], []))
+        hash_list = [self.digests[name] for name in sorted(files)]
+        hash_list.extend(self.hash_dir(name) for name in sorted(dirs))
+        return self.hasher.hash_strings(hash_list)
+
+    def hash_instance(self, instance, log_name):
+        """
+        Return the value HashEngine.hash_instance gives for the extracted
+        instance files.
+
+        """
+
+        return self.hasher.hash_strings([self.hash_dir(instance),
+                                         self.digests[log_name],
+                                         self.digests[instance+'.txt']])
+
+    def describe_audio(self, instance, audio_list):
+        """
+        Return a pair (files, missing) for the audio files named in a
+        log, as AudioValidator.describe does on disk.
+
+        """
+
+        files = []
+        missing = set()
+        seen = set()
+        for item in audio_list:
+            if item in seen:
+                continue
+            seen.add(item)
+            name = posixpath.normpath(instance+'/'+item)
+            if name not in self.audio:
+                missing.add(item)
+                continue
+            verdict, duration, size = self.audio[name]
+            files.append((item, not verdict, size, duration))
+        return files, [item for item in audio_list if item in missing]
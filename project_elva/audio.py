@@ -0,0 +1,197 @@
+import os
+import sndhdr
+import stat
+import struct
+from collections import OrderedDict
+from discovery import ThreadPoolOwner, scandir
+
+AU_HEADER_SIZE = 24
+AU_MAGICS = (b'.snd', b'\0ds.', b'dns.')
+
+# bytes per sample of each .au encoding that has a fixed sample size
+AU_SAMPLE_BYTES = {1: 1, 2: 1, 3: 2, 4: 3, 5: 4, 6: 4, 7: 8, 27: 1}
+AU_UNKNOWN_SIZE = 0xffffffff
+
+# headers remembered by an AudioValidator, so a --follow daemon does not
+# grow without bound
+CACHE_SIZE = 100000
+
+def check_header(header):
+    """
+    Return True if the first bytes of a file identify it as audio, False
+    if they definitely do not, or None if only sndhdr can decide.
+
+    """
+
+    if len(header) == 0:
+        return False
+    if header[:4] in AU_MAGICS:
+        return True
+    return None
+
+def au_duration(header, size):
+    """
+    Return the length in seconds of a Sun .au file from its header and
+    file size, or None if the header does not say.
+
+    """
+
+    # sndhdr reads the two reversed magics as little-endian
+    order = '>' if header[:4] == b'.snd' else '<'
+    offset, data_size, encoding, rate, channels = struct.unpack(order+'5I', header[4:24])
+    if encoding not in AU_SAMPLE_BYTES or not rate or not channels:
+        return None
+    if data_size == AU_UNKNOWN_SIZE or offset + data_size > size:
+        data_size = max(0, size - offset)
+    return float(data_size) / (AU_SAMPLE_BYTES[encoding] * channels * rate)
+
+def sndhdr_duration(info):
+    """
+    Return the length in seconds given by a sndhdr.what() result, or
+    None if it does not say.
+
+    """
+
+    rate, frames = info[1], info[3]
+    if not rate or not frames or rate < 0 or frames < 0:
+        return None
+    return float(frames) / rate
+
+def null_files(audio_list, files):
+    """
+    Return the names in an audio list that describe() found to be null,
+    keeping the order and multiplicity of the list.
+
+    """
+
+    null = set(name for name, is_null, size, duration in files if is_null)
+    return [item for item in audio_list if item in null]
+
+class AudioValidator(ThreadPoolOwner):
+    '''
+    Class that decides which audio files recorded in a log are null,
+    and how long the others are, reading only the Sun .au header of
+    each file.
+
+    '''
+
+    def __init__(self, threads=8, cache_size=CACHE_SIZE):
+        super(AudioValidator, self).__init__(threads)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def inspect(self, path, size, mtime):
+        """
+        Return (is_audio, duration) for a file, caching the result by
+        (path, size, mtime) and dropping the least recently used results
+        beyond cache_size. The duration is None if the header does not
+        give one.
+
+        """
+
+        key = (path, size, mtime)
+        with self._lock:
+            result = self._cache.pop(key, None)
+            if result is not None:
+                self._cache[key] = result
+                return result
+
+        duration = None
+        if size < AU_HEADER_SIZE:
+            # too short to be a .au file, but may still be another format
+            verdict = None if size else False
+        else:
+            with open(path, 'rb') as fp:
+                header = fp.read(AU_HEADER_SIZE)
+            verdict = check_header(header)
+            if verdict:
+                duration = au_duration(header, size)
+        if verdict is None:
+            info = sndhdr.what(path)
+            verdict = info is not None
+            if verdict:
+                duration = sndhdr_duration(info)
+
+        result = (verdict, duration)
+        # the pool's threads share the cache
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def is_audio(self, path, size, mtime):
+        """
+        Return True if a file is valid audio.
+
+        """
+
+        return self.inspect(path, size, mtime)[0]
+
+    def _check(self, item):
+        return self.inspect(*item)
+
+    def stat_dir(self, dir_path):
+        """
+        Return a dict mapping file names in a directory to (size, mtime),
+        taken from a single scandir.
+
+        """
+
+        stats = {}
+        try:
+            for entry in scandir(dir_path):
+                if entry.is_file():
+                    st = entry.stat()
+                    stats[entry.name] = (st.st_size, st.st_mtime)
+        except OSError:
+            pass
+        return stats
+
+    def describe(self, instance_path, audio_list):
+        """
+        Return a pair (files, missing) for the audio files named in a
+        log. files holds (name, is_null, size, duration) for each
+        distinct file found, in log order, and missing the names that
+        were not found.
+
+        """
+
+        stats = self.stat_dir(instance_path)
+
+        missing = set()
+        checks = {}
+        names = []
+        for item in audio_list:
+            if item in checks or item in missing:
+                continue
+            path = instance_path+'/'+item
+            if item in stats:
+                checks[item] = (path,) + stats[item]
+                names.append(item)
+                continue
+            # names with a subdirectory are not in the listing
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is None or not stat.S_ISREG(st.st_mode):
+                missing.add(item)
+                continue
+            checks[item] = (path, st.st_size, st.st_mtime)
+            names.append(item)
+
+        results = self.pool.map(self._check, [checks[name] for name in names])
+        files = [(name, not verdict, checks[name][1], duration)
+                 for name, (verdict, duration) in zip(names, results)]
+        return files, [item for item in audio_list if item in missing]
+
+    def validate(self, instance_path, audio_list):
+        """
+        Return a pair of lists (null, missing) for the audio files named
+        in a log. Null files keep the order and multiplicity of the list.
+
+        """
+
+        files, missing = self.describe(instance_path, audio_list)
+        return null_files(audio_list, files), missing
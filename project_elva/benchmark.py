@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from audio import AudioValidator
+from database import insert_ignore, make_engine
+from datetime import datetime
+from discovery import iter_instances
+from glob import glob
+from hashing import HashEngine
+from models import Base, Instance
+from scanner import LogScanner, parse_timestamp
+from synth import TreeGenerator
+
+class Stage(object):
+    '''
+    Class that times one stage of the benchmark.
+
+    '''
+
+    def __init__(self, name):
+        self.bytes = 0
+        self.items = 0
+        self.name = name
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds += time.time() - self._start
+
+    def to_dict(self):
+        return {
+                'seconds': round(self.seconds, 6),
+                'items': self.items,
+                'items_per_second': round(self.items / max(self.seconds, 1e-9), 2),
+                'megabytes_per_second': round(self.bytes / (1024.0*1024.0) /
+                                              max(self.seconds, 1e-9), 2)
+        }
+
+def insert_rows(engine, rows):
+    """
+    Insert instance rows the way BatchWriter does, in one transaction.
+
+    """
+
+    with engine.begin() as conn:
+        conn.execute(insert_ignore(Instance.__table__, engine.dialect.name, ['guid']), rows)
+
+def run(root, hash_threads=4, audio_threads=8, database_url='sqlite://'):
+    """
+    Time each ingestion stage over an instance tree and return a dict of
+    results per stage.
+
+    """
+
+    stages = dict((name, Stage(name)) for name in
+                  ['discovery', 'hashing', 'log_parsing',
+                   'audio_validation', 'db_insert'])
+
+    with stages['discovery'] as stage:
+        instances = list(iter_instances(root))
+        stage.items = len(instances)
+
+    units = []
+    for instance_path in instances:
+        for log_file in glob(instance_path+'*.log'):
+            units.append([instance_path, log_file, instance_path+'.txt'])
+
+    hasher = HashEngine(threads=hash_threads)
+    with stages['hashing'] as stage:
+        guids = [hasher.hash_instance(files) for files in units]
+        stage.items = len(units)
+        stage.bytes = hasher.bytes_read
+    hasher.close()
+
+    scanner = LogScanner()
+    with stages['log_parsing'] as stage:
+        scans = [scanner.scan(files[1]) for files in units]
+        computers = [scanner.scan_text(files[2]) for files in units]
+        stage.items = len(units)
+        stage.bytes = sum(os.path.getsize(files[1]) for files in units)
+
+    validator = AudioValidator(audio_threads)
+    with stages['audio_validation'] as stage:
+        nulls = [validator.validate(files[0], scan.audio)[0]
+                 for files, scan in zip(units, scans)]
+        stage.items = sum(len(scan.audio) for scan in scans)
+    validator.close()
+
+    rows = []
+    for files, guid, scan, computer, null in zip(units, guids, scans,
+                                                 computers, nulls):
+        rows.append({
+                'guid': guid,
+                'computer': computer,
+                'student_id': int(files[0].split('/')[-1].split('_')[2]),
+                'session_id': 1,
+                'start_time': parse_timestamp(scan.start_time),
+                'end_time': parse_timestamp(scan.end_time),
+                'null_audio_count': len(null),
+                'total_audio_count': len(scan.audio),
+                'slides_finished': len(scan.slides),
+                'audio_files': scan.audio
+        })
+
+    # foreign keys are not enforced, so no students or sessions are needed
+    engine = make_engine(database_url)
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+    with stages['db_insert'] as stage:
+        insert_rows(engine, rows)
+        stage.items = len(rows)
+    engine.dispose()
+
+    return dict((name, stage.to_dict()) for name, stage in stages.items())
+
+def compare(results, baseline, tolerance):
+    """
+    Return a list of stages whose throughput dropped by more than the
+    tolerance (a fraction) compared to a baseline result file.
+
+    """
+
+    regressions = []
+    for name, stage in results['stages'].items():
+        before = baseline['stages'].get(name)
+        if not before or not before['items_per_second']:
+            continue
+        ratio = stage['items_per_second'] / before['items_per_second']
+        if ratio < 1.0 - tolerance:
+            regressions.append((name, ratio))
+    return regressions
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+            description='Time each ingestion stage over a synthetic (or '
+                        'existing) instance tree and write the results to JSON.')
+    parser.add_argument('--root',
+            help='existing instance tree to use instead of generating one')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--database-url', default='sqlite://',
+            help='database for the insert stage (an in-memory SQLite one by default)')
+    parser.add_argument('--baseline',
+            help='earlier result file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+            help='allowed fractional throughput drop against the baseline')
+    parser.add_argument('--hash-threads', type=int, default=4)
+    parser.add_argument('--audio-threads', type=int, default=8)
+    parser.add_argument('--schools', type=int, default=2)
+    parser.add_argument('--students', type=int, default=10)
+    parser.add_argument('--instances', type=int, default=3)
+    parser.add_argument('--log-lines', type=int, default=500)
+    parser.add_argument('--audio', type=int, default=20)
+    parser.add_argument('--audio-bytes', type=int, default=16000)
+    parser.add_argument('--null-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = vars(args).copy()
+    root = args.root
+    if root is None:
+        root = tempfile.mkdtemp(prefix='elva-bench-')
+        TreeGenerator(root,
+                schools=args.schools,
+                students=args.students,
+                instances=args.instances,
+                log_lines=args.log_lines,
+                audio=args.audio,
+                audio_bytes=args.audio_bytes,
+                null_ratio=args.null_ratio,
+                seed=args.seed).generate()
+
+    try:
+        results = {
+                'timestamp': str(datetime.utcnow())[:-7],
+                'python': platform.python_version(),
+                'config': config,
+                'stages': run(root, args.hash_threads, args.audio_threads,
+                              args.database_url)
+        }
+    finally:
+        if args.root is None:
+            shutil.rmtree(root)
+
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, sort_keys=True, indent=4, separators=[', ', ': '])
+
+    for name in sorted(results['stages']):
+        stage = results['stages'][name]
+        print('%-18s %10.3f s %12.1f items/s' % (name, stage['seconds'],
+                                                 stage['items_per_second']))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for name, ratio in regressions:
+            print('REGRESSION %s: %.0f%% of baseline throughput' % (name, ratio*100))
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,67 @@
+import argparse
+import sys
+
+# each command imports its module only when it runs, so that `elva
+# --help` does not pay for SQLAlchemy, openpyxl or the database setup
+
+def ingest(argv):
+    import process
+    return process.main(argv, prog='elva ingest')
+
+def report(argv):
+    import stats
+    return stats.main(argv, prog='elva report')
+
+def refresh_slides(argv):
+    import slides
+    return slides.main(argv, prog='elva refresh-slides')
+
+def init_db(argv):
+    import db_init
+    return db_init.main(argv, prog='elva init-db')
+
+def migrate(argv):
+    import migrate
+    return migrate.main(argv, prog='elva migrate')
+
+def rollup(argv):
+    import rollup
+    return rollup.main(argv, prog='elva rollup')
+
+def sync(argv):
+    import sync
+    return sync.main(argv, prog='elva sync')
+
+COMMANDS = [
+        ('ingest', ingest, 'insert ELVA log instances into the database'),
+        ('report', report, 'write the stats spreadsheet and JSON dump'),
+        ('refresh-slides', refresh_slides, 'update session slide counts from the session .csv files'),
+        ('init-db', init_db, 'create the tables and load the seed data'),
+        ('migrate', migrate, 'add the tables and indexes an existing database is missing'),
+        ('rollup', rollup, 'rebuild or dump the per-student, per-session rollups'),
+        ('sync', sync, 'mirror the remote log tree over SFTP')
+]
+
+def main(argv=None):
+    """
+    Run an elva command. Everything after the command name is parsed
+    by the command itself.
+
+    """
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    commands = dict((name, func) for name, func, help in COMMANDS)
+    if argv and argv[0] in commands:
+        return commands[argv[0]](argv[1:])
+
+    parser = argparse.ArgumentParser(prog='elva',
+            description='ELVA log processing tools.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    for name, func, help in COMMANDS:
+        subparsers.add_parser(name, help=help, add_help=False)
+    # only reached without a known command: show usage or the error
+    parser.parse_args(argv)
+    parser.print_help()
+    return 2
@@ -0,0 +1,183 @@
+import os
+import threading
+from sqlalchemy import create_engine, extract, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine.url import URL, make_url
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.sql.expression import Insert
+
+##################
+# Miscellaneous
+##################
+
+# e.g. sqlite:///elva.db to run without a Postgres server
+DATABASE_URL_ENV = 'ELVA_DATABASE_URL'
+
+# engine options read from the environment, with their defaults
+POOL_SIZE_ENV = 'ELVA_DB_POOL_SIZE'
+MAX_OVERFLOW_ENV = 'ELVA_DB_MAX_OVERFLOW'
+POOL_RECYCLE_ENV = 'ELVA_DB_POOL_RECYCLE'
+POOL_PRE_PING_ENV = 'ELVA_DB_POOL_PRE_PING'
+STATEMENT_TIMEOUT_ENV = 'ELVA_DB_STATEMENT_TIMEOUT'
+STREAM_RESULTS_ENV = 'ELVA_DB_STREAM_RESULTS'
+
+def database_url():
+    """
+    Return the database URL from ELVA_DATABASE_URL if it is set,
+    otherwise the local Postgres database named by the POSTGRES_*
+    variables.
+
+    """
+
+    if os.environ.get(DATABASE_URL_ENV):
+        return os.environ[DATABASE_URL_ENV]
+
+    db_url = {
+            'drivername': 'postgresql',
+            'database': os.environ['POSTGRES_DB'],
+            'username': os.environ['POSTGRES_USER'],
+            'password': os.environ['POSTGRES_PASSWORD'],
+            'host': 'localhost',
+            'port': 5432
+    }
+    return URL(**db_url)
+
+def env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return int(value)
+
+def engine_options(url):
+    """
+    Return the create_engine keyword arguments for a URL, taken from
+    the ELVA_DB_* environment variables.
+
+    """
+
+    backend = make_url(url).drivername.split('+')[0]
+    options = {'pool_pre_ping': env_flag(POOL_PRE_PING_ENV, True)}
+    if backend == 'sqlite':
+        # sqlite uses its own single-connection pools
+        return options
+
+    options['pool_size'] = env_int(POOL_SIZE_ENV, 5)
+    options['max_overflow'] = env_int(MAX_OVERFLOW_ENV, 10)
+    options['pool_recycle'] = env_int(POOL_RECYCLE_ENV, -1)
+    if backend == 'postgresql':
+        timeout = env_int(STATEMENT_TIMEOUT_ENV, 0)
+        if timeout:
+            options['connect_args'] = {'options': '-c statement_timeout=%d' % timeout}
+        if env_flag(STREAM_RESULTS_ENV, False):
+            # server-side cursors, so large reads are not buffered client-side
+            options['execution_options'] = {'stream_results': True}
+    return options
+
+def make_engine(url):
+    """
+    Return an engine for a database URL, configured from the
+    environment.
+
+    """
+
+    return create_engine(url, **engine_options(url))
+
+class SkipConflicts(Insert):
+    '''
+    INSERT that leaves out the rows whose values of a set of unique
+    columns are already taken, for SQLite. Its dialect has no
+    on_conflict_do_nothing() before SQLAlchemy 1.4.
+
+    '''
+
+    # SQLAlchemy 1.4 must not reuse the SQL compiled for other columns
+    inherit_cache = False
+
+    def __init__(self, table, columns, **kwargs):
+        super(SkipConflicts, self).__init__(table, **kwargs)
+        self.conflict_columns = list(columns)
+
+@compiles(SkipConflicts, 'sqlite')
+def compile_skip_conflicts(insert, compiler, **kwargs):
+    # sqlite 3.24 and later
+    return compiler.visit_insert(insert, **kwargs) + \
+           ' ON CONFLICT (%s) DO NOTHING' % ', '.join(insert.conflict_columns)
+
+def insert_ignore(table, dialect_name, columns):
+    """
+    Return an INSERT for a table that skips rows whose values of the
+    given unique columns are already taken, in the form the given
+    dialect understands. Rows that break any other constraint still
+    raise an error.
+
+    """
+
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=columns)
+    if dialect_name == 'sqlite':
+        # not INSERT OR IGNORE, which also drops rows that break NOT
+        # NULL or CHECK constraints
+        return SkipConflicts(table, columns)
+    return table.insert()
+
+def duration_seconds(start, end, dialect_name):
+    """
+    Return an SQL expression for the seconds between two timestamp
+    columns, in the form the given dialect understands.
+
+    """
+
+    if dialect_name == 'postgresql':
+        return extract('epoch', end - start)
+    if dialect_name == 'sqlite':
+        # whole seconds, exactly; julianday() differences pick up float error
+        return func.strftime('%s', end) - func.strftime('%s', start)
+    raise ValueError('no duration expression for %s databases' % dialect_name)
+
+##################
+# Database
+##################
+
+_engine = None
+_engine_pid = None
+_lock = threading.Lock()
+
+def get_engine():
+    """
+    Return the shared engine, creating it on first use. A process
+    forked after that gets an engine (and pool) of its own, rather
+    than sharing the parent's connections.
+
+    """
+
+    global _engine, _engine_pid
+    with _lock:
+        if _engine is None or _engine_pid != os.getpid():
+            _engine = make_engine(database_url())
+            _engine_pid = os.getpid()
+        return _engine
+
+def dispose_engine():
+    """
+    Close every pooled connection of the shared engine, if it exists.
+
+    """
+
+    global _engine
+    with _lock:
+        if _engine is not None and _engine_pid == os.getpid():
+            _engine.dispose()
+        _engine = None
+
+DBSession = sessionmaker()
+
+# one session per process and thread, bound to the engine on first use
+session = scoped_session(lambda: DBSession(bind=get_engine()),
+        scopefunc=lambda: (os.getpid(), threading.current_thread().ident))
@@ -1,128 +1,312 @@
+import argparse
+import csv
 import os
-import paramiko
-import uuid
 from datetime import datetime
-from models import (Base,
-        Computer, Instance,
-        School, Session,
-        Student, Teacher,
-        Unit
-)
-from sqlalchemy import create_engine
-from sqlalchemy import MetaData
-from sqlalchemy.engine.url import URL
-from sqlalchemy.orm import sessionmaker
-
-# TODO: make this a little bit more functional with
-#       command line arguments
-#       this needs to have more fine-grained abilities so
-#       as to not wholesale delete and re-create tables
-#       i.e. postgres-dbtest --drop-all or
-#            postgres-dbtest --recreate units
-
-#db_url = {  
-#            'drivername': 'postgresql',
-#            'database': os.environ['POSTGRES_DB'],
-#            'username': os.environ['POSTGRES_USER'],
-#            'password': os.environ['POSTGRES_PASSWORD'],
-#            'host': 'localhost',
-#            'port': 5432 }
-#engine = create_engine(URL(**db_url))
-#Base.metadata.drop_all(bind=engine)
-#Base.metadata.create_all(bind=engine, checkfirst=True)
-#
-#DBSession = sessionmaker(bind=engine)
-#session = DBSession()
-
-data_dir = '../data/'
-
-print os.path.dirname(os.path.realpath(__file__))
-
-# add computers to DB from file
-with open(data_dir+'computers.csv', 'r') as fp:
-    for line in fp:
-        line = line.strip().split(',')[:1][0]
-        if line[0] != '#':
-            computer = Computer(guid=line)
-            session.add(computer)
-    session.flush()
-
-# add schools to DB from file
-with open(data_dir+'schools.csv', 'r') as fp:
-    for line in fp:
-        line = line.strip().split(',')[:2]
-        if line[0] != '#':
-            school = School(id=line[0], name=line[1])
-            session.add(school)
-    session.flush()
-
-# add units to DB from file
-with open(data_dir+'units.csv', 'r') as fp:
-    for line in fp:
-        line = line.strip().split(',')[:1][0]
-        if line[0] != '#':
-            unit = Unit(name=line)
-            session.add(unit)
-    session.flush()
-
-# add teachers to DB from file
-with open(data_dir+'teachers.csv', 'r') as fp:
-    for line in fp:
-        line = line.strip().split(',')[:3]
-        if line[0] != '#':
-            school = session.query(School).filter_by(name=line[2]).first()
-            teacher = Teacher(id=line[0],
-                    name=line[1],
-                    school_id=school.id
-            )
-            session.add(teacher)
-    session.flush()
-
-# add students to DB from file
-with open(data_dir+'students.csv', 'r') as fp:
-    for line in fp:
-        line = line.strip().split(',')[:4]
-        if line[0] != '#':
-            computer = session.query(Computer).filter_by(guid=line[2]).first()
-            student = Student(id=line[0],
-                    name=line[1],
-                    assigned_comp=computer.id,
-                    teacher_id=line[3],
-            )
-            session.add(student)
-    session.flush()
-
-# add sessions to DB from file
-with open(data_dir+'sessions.csv', 'r') as fp:
-    for line in fp:
-        line = line.strip().split(',')[:3]
-        if line[0] != '#':
-            unit = session.query(Unit).filter_by(name=line[0]).first()
-            sess = Session(unit_id=unit.id,
-                    name=line[1],
-                    slides=line[2]
-            )
-            session.add(sess)
-    session.flush()
-
-with open(data_dir+'sample-instances.csv', 'r') as fp:
-    for line in fp:
-        line = line.strip().split(',')[:9]
-        if line[0] != '#':
-            sess = session.query(Session).filter_by(name=line[2]).first()
-            audio = line[8].split('|')[1:-1]
-            instance = Instance(guid=line[0],
-                    student_id=line[1],
-                    session_id=sess.id,
-                    start_time=datetime.strptime(line[3], '%d/%m/%Y %H:%M:%S'),
-                    end_time=datetime.strptime(line[4], '%d/%m/%Y %H:%M:%S'),
-                    null_audio_count=line[5],
-                    total_audio_count=line[6],
-                    slides_finished=line[7],
-                    audio_files=audio
-            )
-            session.add(instance)
-    session.flush()
+from models import Base
+from database import get_engine, session
+from migrate import upgrade
+from rollup import rebuild_rollups
+from sqlalchemy import bindparam, select
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'data')
+
+BATCH_SIZE = 1000
+
+# tables in load order, with the natural key each is upserted on and
+# the .csv file it is loaded from
+TABLES = [
+        ('computers', 'guid', 'computers.csv'),
+        ('schools', 'id', 'schools.csv'),
+        ('units', 'name', 'units.csv'),
+        ('teachers', 'id', 'teachers.csv'),
+        ('students', 'id', 'students.csv'),
+        ('sessions', 'name', 'sessions.csv'),
+        ('instances', 'guid', 'sample-instances.csv')
+]
+TABLE_NAMES = [name for name, key, filename in TABLES]
+
+# tables holding ingested data, which --recreate only drops with --force
+INGEST_TABLES = ['instances', 'audio_files', 'rollups']
+
+def dependent_tables(names):
+    """
+    Return the given tables together with every table that references
+    one of them, directly or not, in dependency order. This includes
+    tables filled at ingest rather than from seed data.
+
+    """
+
+    names = set(names)
+    for table in Base.metadata.sorted_tables:
+        if any(fk.column.table.name in names for fk in table.foreign_keys):
+            names.add(table.name)
+    return [table.name for table in Base.metadata.sorted_tables
+            if table.name in names]
+
+def ingest_tables(names):
+    """
+    Return the tables holding ingested data that recreating the given
+    tables would drop.
+
+    """
+
+    return [name for name in dependent_tables(names) if name in INGEST_TABLES]
+
+class SeedLoader(object):
+    '''
+    Class that loads the seed .csv files into the database. Foreign keys
+    are resolved from in-memory maps of the referenced tables, built
+    once per load, and rows are written with batched INSERTs and
+    UPDATEs matched on each table's natural key, so loading the same
+    files twice leaves the tables unchanged.
+
+    '''
+
+    def __init__(self, session, data_dir=DATA_DIR, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.data_dir = data_dir
+        self._maps = {}
+        self._session = session
+
+    def key_map(self, table_name, column):
+        """
+        Return a dict mapping each value of a column to the id of its
+        row, reading the table only the first time it is asked for.
+
+        """
+
+        if (table_name, column) not in self._maps:
+            table = Base.metadata.tables[table_name]
+            if column == 'id':
+                rows = ((id, id) for (id,) in self._session.execute(select([table.c.id])))
+            else:
+                rows = self._session.execute(select([table.c[column], table.c.id]))
+            self._maps[(table_name, column)] = dict((value, id) for value, id in rows)
+        return self._maps[(table_name, column)]
+
+    def read(self, filename, fields):
+        """
+        Yield the line number and first fields of each row of a .csv
+        file, skipping blank and comment rows.
+
+        """
+
+        with open(os.path.join(self.data_dir, filename), 'r') as fp:
+            for line_number, row in enumerate(csv.reader(fp), 1):
+                if not row or row[0].lstrip().startswith('#'):
+                    continue
+                if len(row) < fields:
+                    raise ValueError('%s line %d: expected %d fields, found %d'
+                                     % (filename, line_number, fields, len(row)))
+                yield line_number, [field.strip() for field in row[:fields]]
+
+    def lookup(self, table_name, column, value, filename, line_number):
+        id = self.key_map(table_name, column).get(value)
+        if id is None:
+            raise ValueError('%s line %d: no %s with %s %r'
+                             % (filename, line_number, table_name, column, value))
+        return id
+
+    def rows(self, table_name, filename):
+        """
+        Return the rows of a table read from its .csv file.
+
+        """
+
+        if table_name == 'computers':
+            return [{'guid': line[0]}
+                    for line_number, line in self.read(filename, 1)]
+
+        if table_name == 'schools':
+            return [{'id': int(line[0]), 'name': line[1]}
+                    for line_number, line in self.read(filename, 2)]
+
+        if table_name == 'units':
+            return [{'name': line[0]}
+                    for line_number, line in self.read(filename, 1)]
+
+        if table_name == 'teachers':
+            return [{'id': int(line[0]),
+                     'name': line[1],
+                     'school_id': self.lookup('schools', 'name', line[2],
+                                              filename, line_number)}
+                    for line_number, line in self.read(filename, 3)]
+
+        if table_name == 'students':
+            return [{'id': int(line[0]),
+                     'name': line[1],
+                     'assigned_comp': self.lookup('computers', 'guid', line[2],
+                                                  filename, line_number),
+                     'teacher_id': int(line[3])}
+                    for line_number, line in self.read(filename, 4)]
+
+        if table_name == 'sessions':
+            return [{'unit_id': self.lookup('units', 'name', line[0],
+                                            filename, line_number),
+                     'name': line[1],
+                     'slides': int(line[2])}
+                    for line_number, line in self.read(filename, 3)]
+
+        if table_name == 'instances':
+            return [{'guid': line[0],
+                     'student_id': int(line[1]),
+                     'session_id': self.lookup('sessions', 'name', line[2],
+                                               filename, line_number),
+                     'start_time': datetime.strptime(line[3], '%d/%m/%Y %H:%M:%S'),
+                     'end_time': datetime.strptime(line[4], '%d/%m/%Y %H:%M:%S'),
+                     'null_audio_count': int(line[5]),
+                     'total_audio_count': int(line[6]),
+                     'slides_finished': int(line[7]),
+                     'audio_files': line[8].split('|')[1:-1]}
+                    for line_number, line in self.read(filename, 9)]
+
+        raise ValueError('no seed data for table %r' % table_name)
+
+    def upsert(self, table_name, key, rows):
+        """
+        Insert the rows whose key is not yet in the table and update
+        the rest, in batches. Return the number inserted and updated.
+
+        """
+
+        table = Base.metadata.tables[table_name]
+        existing = self.key_map(table_name, key)
+
+        # a key repeated in the file keeps its last row
+        latest = {}
+        for row in rows:
+            latest[row[key]] = row
+
+        inserts = []
+        updates = []
+        for value, row in latest.items():
+            if value in existing:
+                row = dict((column, row[column]) for column in row if column != 'id')
+                row['b_id'] = existing[value]
+                updates.append(row)
+            else:
+                inserts.append(row)
+
+        for batch in self.batches(inserts):
+            self._session.execute(table.insert(), batch)
+        update = table.update().where(table.c.id == bindparam('b_id'))
+        for batch in self.batches(updates):
+            self._session.execute(update, batch)
+
+        # new rows have ids now, so the next lookup reads the table again
+        for map_key in list(self._maps):
+            if map_key[0] == table_name:
+                del self._maps[map_key]
+        return len(inserts), len(updates)
+
+    def batches(self, rows):
+        for start in range(0, len(rows), self.batch_size):
+            yield rows[start:start+self.batch_size]
+
+    def load(self, table_names=TABLE_NAMES):
+        """
+        Load the given tables from their .csv files in one transaction,
+        returning a list of (table, inserted, updated).
+
+        """
+
+        counts = []
+        try:
+            for table_name, key, filename in TABLES:
+                if table_name in table_names:
+                    inserted, updated = self.upsert(table_name, key,
+                                                    self.rows(table_name, filename))
+                    counts.append((table_name, inserted, updated))
+            if 'instances' in table_names:
+                rebuild_rollups(self._session)
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+        return counts
+
+def init_db(data_dir=DATA_DIR, drop_all=False, recreate=(), upsert=(),
+            batch_size=BATCH_SIZE, force=False):
+    """
+    Create any missing tables and indexes and load the seed data from
+    data_dir.
+    Every table is upserted unless recreate or upsert name the tables
+    to load. A recreated table is dropped first, and so is every table
+    that references it, since their rows point at the old ids. Unless
+    force is set, a recreate that would drop ingested data raises
+    ValueError; upserting keeps the ids and the rows that use them.
+
+    """
+
+    if recreate and not force:
+        ingested = ingest_tables(recreate)
+        if ingested:
+            raise ValueError('recreating %s would drop the ingested tables %s'
+                             % (', '.join(recreate), ', '.join(ingested)))
+
+    engine = get_engine()
+    if drop_all:
+        Base.metadata.drop_all(bind=engine)
+    elif recreate:
+        recreate = dependent_tables(recreate)
+        Base.metadata.drop_all(bind=engine,
+                tables=[Base.metadata.tables[name] for name in recreate])
+    # adds any tables and indexes the database is missing
+    upgrade(engine)
+
+    if recreate or upsert:
+        # tables filled at ingest are left empty
+        tables = (set(recreate) & set(TABLE_NAMES)) | set(upsert)
+    else:
+        tables = TABLE_NAMES
+
+    loader = SeedLoader(session, data_dir, batch_size)
+    return loader.load(tables)
+
+def main(argv=None, prog=None):
+    """
+    Initialise the database with command line arguments.
+
+    """
+
+    parser = argparse.ArgumentParser(prog=prog,
+            description='Create the ELVA tables and load the seed data. '
+                        'Loading is idempotent: rows already present are updated.')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+            help='directory holding the seed .csv files')
+    parser.add_argument('--drop-all', action='store_true',
+            help='drop every table before loading')
+    parser.add_argument('--recreate', action='append', default=[],
+            choices=TABLE_NAMES, metavar='TABLE',
+            help='drop and reload a table and the tables that reference it '
+                 '(repeatable); refused if that drops the ingested instances, '
+                 'audio_files or rollups tables unless --force is given. '
+                 'Use --upsert to reload a table and keep them')
+    parser.add_argument('--upsert', action='append', default=[],
+            choices=TABLE_NAMES, metavar='TABLE',
+            help='load only this table (repeatable)')
+    parser.add_argument('--force', action='store_true',
+            help='let --recreate drop the tables filled at ingest')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+            help='rows per INSERT or UPDATE batch')
+    args = parser.parse_args(argv)
+
+    if args.drop_all and (args.recreate or args.upsert):
+        parser.error('--drop-all reloads every table; '
+                     'it cannot be combined with --recreate or --upsert')
+    if args.recreate and not args.force and ingest_tables(args.recreate):
+        parser.error('--recreate %s would drop the ingested tables %s; '
+                     'pass --force to drop them or use --upsert to keep them'
+                     % (' '.join(args.recreate), ', '.join(ingest_tables(args.recreate))))
+
+    counts = init_db(args.data_dir,
+            drop_all=args.drop_all,
+            recreate=args.recreate,
+            upsert=args.upsert,
+            batch_size=args.batch_size,
+            force=args.force)
+    for table_name, inserted, updated in counts:
+        print('%s: %d inserted, %d updated' % (table_name, inserted, updated))
 
 #instances = session.query(Instance).filter_by(student_id=103065).all()
 #for item in instances:
@@ -187,3 +371,6 @@ with open(data_dir+'sample-instances.csv', 'r') as fp:
 
 #session.commit()
 #session.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import re
+import threading
+from eventlog import EventLogger
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    # python 2.7 needs the scandir backport
+    from scandir import scandir
+
+INSTANCE_REGEXP = re.compile('[a-zA-Z]+_[\d]_[\d]{6}_[\d]{2}-[\d]{2}-[\d]{4}')
+
+# suffix of a file `elva sync` is still copying; never ingested
+PART_SUFFIX = '.part'
+
+proc_logger = EventLogger('proc-logger')
+
+class ThreadPoolOwner(object):
+    '''
+    Base class for objects that fan work out to a pool of self.threads
+    threads. The pool is started on first use in each process, and it
+    and the lock guarding shared state are left out when the object is
+    pickled for a worker process.
+
+    '''
+
+    def __init__(self, threads):
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        state['_pid'] = None
+        state['_pool'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # threads do not survive a fork, so each process needs its own pool
+        if self._pool is None or self._pid != os.getpid():
+            self._pool = ThreadPool(self.threads)
+            self._pid = os.getpid()
+        return self._pool
+
+    def close(self):
+        """
+        Stop the thread pool.
+
+        """
+
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.close()
+            self._pool.join()
+        self._pool = None
+
+def iter_instances(root):
+    """
+    Yield each instance directory below root as soon as it is found.
+    Instance directories are not descended into, and the sibling .txt
+    and .log files are checked against the parent directory listing
+    rather than with extra stat calls.
+
+    """
+
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            entries = list(scandir(path))
+        except OSError:
+            continue
+        names = set(entry.name for entry in entries)
+
+        subdirs = []
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if not INSTANCE_REGEXP.search(entry.path):
+                subdirs.append(entry.path)
+                continue
+            if re.search('000000', entry.path):
+                continue
+
+            if entry.name+'.txt' not in names:
+                proc_logger.warning('text_missing', entry.name,
+                        '%s.txt does not exist.', entry.path)
+                continue
+            if entry.name+'.log' not in names:
+                proc_logger.warning('log_missing', entry.name,
+                        '%s.log does not exist.', entry.path)
+                continue
+
+            proc_logger.debug('instance_queued', entry.name,
+                    '%s was added to queue.', entry.name)
+            yield entry.path
+
+        # visit subdirectories in listing order
+        stack.extend(reversed(subdirs))
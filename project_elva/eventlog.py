@@ -0,0 +1,166 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import threading
+import time
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # python 2.7 has neither, so carry minimal versions of the 3.x classes
+
+    class QueueHandler(logging.Handler):
+        '''
+        Class that sends log records to a queue.
+
+        '''
+
+        def __init__(self, queue):
+            logging.Handler.__init__(self)
+            self.queue = queue
+
+        def prepare(self, record):
+            return record
+
+        def emit(self, record):
+            try:
+                self.queue.put_nowait(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        '''
+        Class that takes log records off a queue in a background thread
+        and passes them to a set of handlers.
+
+        '''
+
+        _sentinel = None
+
+        def __init__(self, queue, *handlers):
+            self.handlers = handlers
+            self.queue = queue
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def handle(self, record):
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+        def _monitor(self):
+            while True:
+                record = self.queue.get()
+                if record is self._sentinel:
+                    break
+                self.handle(record)
+
+        def stop(self):
+            self.queue.put_nowait(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+##################
+# Miscellaneous
+##################
+
+# types that can be pickled onto the queue as format arguments
+PLAIN_TYPES = (int, float, str, type(u''), type(None))
+
+class JSONFormatter(logging.Formatter):
+    '''
+    Class that formats each record as one JSON object per line, with the
+    event code and instance carried separately from the message.
+
+    '''
+
+    def format(self, record):
+        entry = {
+                'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(record.created)),
+                'level': record.levelname,
+                'event': getattr(record, 'event', None),
+                'instance': getattr(record, 'instance', None),
+                'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, sort_keys=True)
+
+class LazyQueueHandler(QueueHandler):
+    '''
+    Class that queues records without formatting them, so the message
+    is only built by the listener thread that writes it out.
+
+    '''
+
+    def prepare(self, record):
+        if record.exc_info:
+            # tracebacks cannot be pickled onto a multiprocessing queue
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.args and not all(isinstance(arg, PLAIN_TYPES) for arg in record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+class EventLogger(object):
+    '''
+    Class that logs events with a machine-readable event code and the
+    instance they concern. Messages use lazy %-style arguments and are
+    not formatted at all when the level is disabled.
+
+    '''
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def log(self, level, event, instance, msg, *args):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, *args,
+                            extra={'event': event, 'instance': instance})
+
+    def debug(self, event, instance, msg, *args):
+        self.log(logging.DEBUG, event, instance, msg, *args)
+
+    def info(self, event, instance, msg, *args):
+        self.log(logging.INFO, event, instance, msg, *args)
+
+    def warning(self, event, instance, msg, *args):
+        self.log(logging.WARNING, event, instance, msg, *args)
+
+    def error(self, event, instance, msg, *args):
+        self.log(logging.ERROR, event, instance, msg, *args)
+
+def start_logging(name, filename, max_bytes=5*1024*1024, backup_count=5):
+    """
+    Send everything logged to a logger through a queue to a rotating
+    JSON lines file written by a background thread, and return the
+    listener. The queue is a multiprocessing one, so forked workers log
+    through the same listener.
+
+    """
+
+    handler = logging.handlers.RotatingFileHandler(
+                filename,
+                maxBytes=max_bytes,
+                backupCount=backup_count)
+    handler.setFormatter(JSONFormatter())
+
+    queue = multiprocessing.Queue(-1)
+    listener = QueueListener(queue, handler)
+    listener.start()
+    # flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(LazyQueueHandler(queue))
+    return listener
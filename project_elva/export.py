@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+from database import session
+from models import (Computer, Instance,
+        School, Session,
+        Student, Teacher
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+##################
+# Miscellaneous
+##################
+
+CHUNK_SIZE = 100000
+MANIFEST = 'manifest.json'
+
+# ids below the last one exported that are read again on each run, as
+# ingest workers can commit their batches out of id order
+OVERLAP = 10000
+
+# (name, type) of each exported column, in query order
+COLUMNS = [
+        ('instance_id', 'int'),
+        ('guid', 'str'),
+        ('school_id', 'int'),
+        ('school', 'str'),
+        ('teacher_id', 'int'),
+        ('teacher', 'str'),
+        ('assigned_computer', 'str'),
+        ('computer', 'str'),
+        ('student_id', 'int'),
+        ('student', 'str'),
+        ('session', 'str'),
+        ('session_slides', 'int'),
+        ('start_time', 'datetime'),
+        ('end_time', 'datetime'),
+        ('duration', 'int'),
+        ('slides_finished', 'int'),
+        ('null_audio_count', 'int'),
+        ('total_audio_count', 'int')
+]
+
+def query_rows(db_session, after_id=0):
+    """
+    Return a query over the instance join for every instance whose id
+    is greater than after_id, in id order.
+
+    """
+
+    return db_session.query(Instance.id, Instance.guid,
+                            School.id, School.name,
+                            Teacher.id, Teacher.name,
+                            Computer.guid, Instance.computer,
+                            Student.id, Student.name,
+                            Session.name, Session.slides,
+                            Instance.start_time, Instance.end_time,
+                            Instance.slides_finished,
+                            Instance.null_audio_count,
+                            Instance.total_audio_count).\
+                      select_from(Instance).\
+                      outerjoin(Instance.session).\
+                      outerjoin(Instance.student).\
+                      outerjoin(Student.computer).\
+                      outerjoin(Student.teacher).\
+                      outerjoin(Teacher.school).\
+                      filter(Instance.id > after_id).\
+                      order_by(Instance.id)
+
+def iter_chunks(rows, chunk_size=CHUNK_SIZE):
+    """
+    Yield dicts of column lists holding up to chunk_size rows each.
+
+    """
+
+    chunk = None
+    for row in rows:
+        if chunk is None:
+            chunk = dict((name, []) for name, kind in COLUMNS)
+        values = list(row)
+        # duration in seconds sits between end_time and slides_finished
+        start_time, end_time = values[12], values[13]
+        duration = None
+        if start_time is not None and end_time is not None:
+            duration = int((end_time - start_time).total_seconds())
+        values.insert(14, duration)
+
+        for (name, kind), value in zip(COLUMNS, values):
+            chunk[name].append(value)
+        if len(chunk['instance_id']) >= chunk_size:
+            yield chunk
+            chunk = None
+    if chunk is not None:
+        yield chunk
+
+class ColumnarExporter(object):
+    '''
+    Class that exports the instance join to a directory of columnar
+    part files. A manifest records the parts and the last Instance.id
+    exported, so each run only appends instances added since. The last
+    overlap ids are read again, and the GUIDs already exported among
+    them are skipped, so an instance committed after one with a higher
+    id is still exported, and only once.
+
+    '''
+
+    def __init__(self, output_dir, file_format=None, chunk_size=CHUNK_SIZE,
+                 overlap=OVERLAP):
+        if file_format is None:
+            file_format = 'parquet' if pyarrow is not None else 'npz'
+        if file_format == 'parquet' and pyarrow is None:
+            raise ImportError('parquet export requires pyarrow')
+        if file_format == 'npz' and numpy is None:
+            raise ImportError('npz export requires numpy')
+
+        self.chunk_size = chunk_size
+        self.file_format = file_format
+        self.output_dir = output_dir
+        self.overlap = overlap
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.output_dir, MANIFEST)
+
+    def load_manifest(self):
+        """
+        Return the manifest of earlier exports, or an empty one.
+
+        """
+
+        if not os.path.isfile(self.manifest_path):
+            return self.new_manifest()
+        with open(self.manifest_path, 'r') as fp:
+            return json.load(fp)
+
+    def new_manifest(self):
+        # recent maps the GUIDs exported within the overlap to their ids
+        return {'format': self.file_format, 'last_id': 0, 'parts': [], 'recent': {}}
+
+    def save_manifest(self, manifest):
+        with open(self.manifest_path+'.tmp', 'w') as fp:
+            json.dump(manifest, fp, sort_keys=True, indent=4, separators=[', ', ': '])
+        os.rename(self.manifest_path+'.tmp', self.manifest_path)
+
+    def export(self, db_session, full=False):
+        """
+        Write every instance not yet exported to new part files and
+        return the number of rows written. With full set, the earlier
+        parts are removed and everything is exported again.
+
+        """
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        manifest = self.load_manifest()
+        if full:
+            for part in manifest['parts']:
+                path = os.path.join(self.output_dir, part['file'])
+                if os.path.exists(path):
+                    os.remove(path)
+            manifest = self.new_manifest()
+        elif manifest['parts'] and manifest['format'] != self.file_format:
+            raise ValueError('%s holds %s parts; use the same format or a full export'
+                             % (self.output_dir, manifest['format']))
+        manifest['format'] = self.file_format
+
+        if 'recent' in manifest:
+            recent = manifest['recent']
+            after_id = max(0, manifest['last_id'] - self.overlap)
+        else:
+            # manifests written before the overlap was kept
+            recent = manifest['recent'] = {}
+            after_id = manifest['last_id']
+
+        rows = query_rows(db_session, after_id).yield_per(self.chunk_size)
+        rows = (row for row in rows if row[1] not in recent)
+        written = 0
+        for chunk in iter_chunks(rows, self.chunk_size):
+            name = 'part-%05d.%s' % (len(manifest['parts']), self.file_format)
+            path = os.path.join(self.output_dir, name)
+            if self.file_format == 'parquet':
+                self.write_parquet(path, chunk)
+            else:
+                self.write_npz(path, chunk)
+
+            count = len(chunk['instance_id'])
+            manifest['parts'].append({
+                    'file': name,
+                    'rows': count,
+                    'first_id': chunk['instance_id'][0],
+                    'last_id': chunk['instance_id'][-1]
+            })
+            manifest['last_id'] = max(manifest['last_id'], chunk['instance_id'][-1])
+            recent.update(zip(chunk['guid'], chunk['instance_id']))
+            for guid, instance_id in list(recent.items()):
+                if instance_id <= manifest['last_id'] - self.overlap:
+                    del recent[guid]
+            # save after every part so an interrupted export resumes cleanly
+            self.save_manifest(manifest)
+            written += count
+        return written
+
+    def write_parquet(self, path, chunk):
+        types = {
+                'int': pyarrow.int64(),
+                'str': pyarrow.string(),
+                'datetime': pyarrow.timestamp('us')
+        }
+        table = pyarrow.Table.from_arrays(
+                [pyarrow.array(chunk[name], type=types[kind]) for name, kind in COLUMNS],
+                names=[name for name, kind in COLUMNS])
+        pyarrow.parquet.write_table(table, path+'.tmp', compression='snappy')
+        os.rename(path+'.tmp', path)
+
+    def write_npz(self, path, chunk):
+        # .npz has no nulls: missing ints are -1 and missing strings ''
+        arrays = {}
+        for name, kind in COLUMNS:
+            values = chunk[name]
+            if kind == 'int':
+                arrays[name] = numpy.array([-1 if value is None else value
+                                            for value in values], dtype=numpy.int64)
+            elif kind == 'datetime':
+                arrays[name] = numpy.array(values, dtype='datetime64[s]')
+            else:
+                arrays[name] = numpy.array([u'' if value is None else value
+                                            for value in values], dtype='U')
+        # savez appends .npz to names without it, so the temporary name keeps it
+        with open(path+'.tmp', 'wb') as fp:
+            numpy.savez_compressed(fp, **arrays)
+        os.rename(path+'.tmp', path)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+            description='Export the instances table, joined with its school, '
+                        'teacher, computer, student and session, to columnar files.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--format', choices=['parquet', 'npz'],
+            help='file format (parquet if pyarrow is installed, otherwise npz)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+            help='rows per part file')
+    parser.add_argument('--overlap', type=int, default=OVERLAP,
+            help='ids below the last exported one to read again, for '
+                 'instances committed out of id order')
+    parser.add_argument('--full', action='store_true',
+            help='discard earlier parts and export every instance again')
+    args = parser.parse_args()
+
+    exporter = ColumnarExporter(args.output_dir,
+            file_format=args.format,
+            chunk_size=args.chunk_size,
+            overlap=args.overlap)
+    rows = exporter.export(session, full=args.full)
+    print('%d instances exported to %s' % (rows, args.output_dir))
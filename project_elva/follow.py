@@ -0,0 +1,290 @@
+import os
+import time
+from collections import OrderedDict
+from discovery import INSTANCE_REGEXP, scandir
+from eventlog import EventLogger
+from glob import glob
+from state import stat_fingerprint
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+proc_logger = EventLogger('proc-logger')
+
+# processed instances remembered by a Follower; one forgotten and then
+# reported again is still skipped, by its fingerprint or GUID
+DONE_SIZE = 10000
+
+def instance_for(dir_path, name):
+    """
+    Return the instance path that a directory entry belongs to (the
+    instance directory itself, its .txt or one of its logs), or None.
+
+    """
+
+    res = INSTANCE_REGEXP.search(name)
+    if res is None or '000000' in name:
+        return None
+    return os.path.join(dir_path, name[:res.end()])
+
+class PollingWatcher(object):
+    '''
+    Class that finds new instances by polling the source tree. Only
+    directories whose mtime has changed since the last poll are listed
+    again, so an idle tree costs one stat per directory.
+
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        self._dirs = {}
+
+    def poll(self, timeout):
+        """
+        Wait for timeout seconds and return the set of instance paths
+        found in directories that changed.
+
+        """
+
+        time.sleep(timeout)
+        return self.scan()
+
+    def scan(self):
+        """
+        Return the set of instance paths in directories that changed
+        since the last scan.
+
+        """
+
+        changed = set()
+        seen = {}
+        stack = [self.root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+
+            cached = self._dirs.get(path)
+            if cached is not None and cached[0] == mtime:
+                seen[path] = cached
+                stack.extend(cached[1])
+                continue
+
+            subdirs = []
+            try:
+                for entry in scandir(path):
+                    instance_path = instance_for(path, entry.name)
+                    if instance_path is not None:
+                        changed.add(instance_path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+            except OSError:
+                continue
+            seen[path] = (mtime, subdirs)
+            stack.extend(subdirs)
+
+        # forget directories that have been removed
+        self._dirs = seen
+        return changed
+
+class InotifyWatcher(PollingWatcher):
+    '''
+    Class that finds new instances from inotify events. Every directory
+    above the instances is watched; instance directories themselves are
+    not, as they are checked when their instance is pending.
+
+    '''
+
+    def __init__(self, root):
+        super(InotifyWatcher, self).__init__(root)
+        self._inotify = INotify()
+        self._mask = flags.CREATE | flags.MOVED_TO | flags.CLOSE_WRITE | \
+                     flags.MODIFY | flags.DELETE_SELF
+        self._watches = {}
+
+    def add_watches(self):
+        """
+        Watch every directory found by the last scan.
+
+        """
+
+        watched = set(self._watches.values())
+        for path in self._dirs:
+            if path not in watched:
+                try:
+                    wd = self._inotify.add_watch(path, self._mask)
+                except OSError:
+                    continue
+                self._watches[wd] = path
+
+    def poll(self, timeout):
+        """
+        Wait up to timeout seconds for events and return the set of
+        instance paths they touched.
+
+        """
+
+        if not self._watches:
+            # the first poll lists the whole tree and sets up the watches
+            changed = self.scan()
+            self.add_watches()
+            return changed
+
+        changed = set()
+        new_dirs = False
+        overflowed = False
+        for event in self._inotify.read(timeout=int(timeout*1000)):
+            if event.mask & flags.Q_OVERFLOW:
+                overflowed = True
+                continue
+            path = self._watches.get(event.wd)
+            if path is None:
+                continue
+            if event.mask & flags.DELETE_SELF:
+                del self._watches[event.wd]
+                continue
+            instance_path = instance_for(path, event.name)
+            if instance_path is not None:
+                changed.add(instance_path)
+            elif event.mask & flags.ISDIR:
+                new_dirs = True
+
+        if overflowed:
+            # events were dropped, so list the whole tree again as the
+            # first poll does; a changed log does not change the mtime of
+            # its directory
+            proc_logger.warning('inotify_overflow', self.root,
+                    'inotify queue overflowed, rescanning the source tree')
+            self._dirs = {}
+            changed |= self.scan()
+            self.add_watches()
+        elif new_dirs:
+            # pick up instances already inside newly created directories
+            changed |= self.scan()
+            self.add_watches()
+        return changed
+
+class Follower(object):
+    '''
+    Class that keeps a Processor running over a source tree, processing
+    each instance once its files have stopped changing.
+
+    '''
+
+    def __init__(self, proc, session, interval=5, settle=30,
+                 roster_interval=600, done_size=DONE_SIZE):
+        self.done_size = done_size
+        self.interval = interval
+        self.proc = proc
+        self.roster_interval = roster_interval
+        self.running = False
+        self.settle = settle
+        self._done = OrderedDict()
+        self._pending = {}
+        self._session = session
+
+        if INotify is not None:
+            self.watcher = InotifyWatcher(proc.root)
+        else:
+            self.watcher = PollingWatcher(proc.root)
+
+    def signature(self, instance_path):
+        """
+        Return a value that changes whenever any file of an instance
+        changes, or None if the instance is not complete yet.
+
+        """
+
+        text_file = instance_path+'.txt'
+        if not os.path.isdir(instance_path) or not os.path.isfile(text_file):
+            return None
+        if glob(instance_path+'*.lck'):
+            return None
+
+        log_files = sorted(self.proc.get_logs(instance_path))
+        if not log_files:
+            return None
+        return tuple(stat_fingerprint([instance_path, log_file, text_file])
+                     for log_file in log_files)
+
+    def process_settled(self):
+        """
+        Process every pending instance whose signature has not changed
+        for settle seconds.
+
+        """
+
+        now = time.time()
+        for instance_path, (signature, since) in list(self._pending.items()):
+            if not os.path.exists(instance_path) and \
+               not os.path.exists(instance_path+'.txt'):
+                del self._pending[instance_path]
+                continue
+
+            current = self.signature(instance_path)
+            if current is None or current != signature:
+                self._pending[instance_path] = (current, now)
+                continue
+            if now - since < self.settle:
+                continue
+
+            del self._pending[instance_path]
+            if self._done.get(instance_path) == current:
+                continue
+
+            try:
+                self.proc.process(instance_path)
+            except Exception as e:
+                self._session.rollback()
+                proc_logger.error('process_failed', instance_path.split('/')[-1],
+                        'failed to process instance - %s', str(e))
+                continue
+            self.mark_done(instance_path, current)
+
+    def mark_done(self, instance_path, signature):
+        """
+        Remember the signature an instance was processed at, forgetting
+        the instances processed longest ago beyond done_size.
+
+        """
+
+        self._done.pop(instance_path, None)
+        self._done[instance_path] = signature
+        while len(self._done) > self.done_size:
+            self._done.popitem(last=False)
+
+    def run(self):
+        """
+        Watch the source tree until stop() is called.
+
+        """
+
+        self.running = True
+        last_refresh = time.time()
+        while self.running:
+            for instance_path in self.watcher.poll(self.interval):
+                if instance_path in self._pending:
+                    continue
+                # siblings of a new instance are reported too
+                if instance_path in self._done and \
+                   self._done[instance_path] == self.signature(instance_path):
+                    continue
+                self._pending[instance_path] = (None, time.time())
+
+            if time.time() - last_refresh >= self.roster_interval:
+                self.proc.roster.invalidate()
+                last_refresh = time.time()
+
+            self.process_settled()
+
+    def stop(self):
+        """
+        Stop watching after the current poll.
+
+        """
+
+        self.running = False
@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import mmap
+import os
+import time
+from discovery import ThreadPoolOwner
+
+##################
+# Miscellaneous
+##################
+
+ALGORITHMS = ['sha1', 'blake2b']
+BUFFER_SIZE = 65536
+MMAP_THRESHOLD = 8*1024*1024
+
+def new_hash(algorithm):
+    """
+    Return a new hash object for one of ALGORITHMS.
+
+    """
+
+    if algorithm not in ALGORITHMS:
+        raise ValueError('unsupported hash algorithm: '+str(algorithm))
+    if algorithm == 'blake2b' and not hasattr(hashlib, 'blake2b'):
+        # python 2.7 needs the pyblake2 backport
+        from pyblake2 import blake2b
+        return blake2b()
+    return hashlib.new(algorithm)
+
+class HashEngine(ThreadPoolOwner):
+    '''
+    Class that hashes instance files and directories. With the default
+    'sha1' algorithm the digests are identical to the ones the processor
+    has always stored as instance GUIDs.
+
+    '''
+
+    def __init__(self, algorithm='sha1', threads=4,
+                 mmap_threshold=MMAP_THRESHOLD):
+        new_hash(algorithm)
+        super(HashEngine, self).__init__(threads)
+        self.algorithm = algorithm
+        self.bytes_read = 0
+        self.mmap_threshold = mmap_threshold
+
+    def hash_dir(self, dir_path):
+        """
+        Return a hash value representing the hash of each file in a
+        directory, hashing the files concurrently.
+
+        """
+
+        files = []
+        dirs = []
+        for item in os.listdir(dir_path):
+            if os.path.isdir(os.path.join(dir_path, item)):
+                dirs.append(item)
+            else:
+                files.append(item)
+
+        paths = [os.path.join(dir_path, item) for item in sorted(files)]
+        if self.threads > 1 and len(paths) > 1:
+            file_hashes = self.pool.map(self.hash_file, paths)
+        else:
+            file_hashes = [self.hash_file(path) for path in paths]
+        for item in sorted(dirs):
+            file_hashes.append(self.hash_dir(os.path.join(dir_path, item)))
+        return self.hash_strings(file_hashes)
+
+    def hash_file(self, file_path):
+        """
+        Return a hash value for a given file, memory-mapping large files.
+
+        """
+
+        digest = new_hash(self.algorithm)
+        with open(file_path, 'rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if size >= self.mmap_threshold:
+                buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    digest.update(buf)
+                finally:
+                    buf.close()
+            else:
+                for chunk in iter(lambda: fp.read(BUFFER_SIZE), b""):
+                    digest.update(chunk)
+        with self._lock:
+            self.bytes_read += size
+        return digest.hexdigest()
+
+    def hash_instance(self, instance_files):
+        """
+        Return a hash value representing a given instance.
+
+        """
+
+        hash_list = []
+        if os.path.isdir(instance_files[0]):
+            hash_list.append(self.hash_dir(instance_files[0]))
+        if os.path.isfile(instance_files[1]):
+            hash_list.append(self.hash_file(instance_files[1]))
+        if os.path.isfile(instance_files[2]):
+            hash_list.append(self.hash_file(instance_files[2]))
+        return self.hash_strings(hash_list)
+
+    def hash_strings(self, hex_digests):
+        """
+        Return the hash of a list of hex digests joined together.
+
+        """
+
+        digest = new_hash(self.algorithm)
+        digest.update(''.join(hex_digests).encode('ascii'))
+        return str(digest.hexdigest())
+
+def benchmark(dir_path, algorithms, thread_counts, repeat=3):
+    """
+    Hash a directory with each algorithm and thread count, returning a
+    list of (algorithm, threads, MB/s) using the best of several runs.
+
+    """
+
+    results = []
+    for algorithm in algorithms:
+        for threads in thread_counts:
+            engine = HashEngine(algorithm, threads=threads)
+            best = None
+            for n in range(repeat):
+                engine.bytes_read = 0
+                start = time.time()
+                engine.hash_dir(dir_path)
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            engine.close()
+            results.append((algorithm, threads,
+                            engine.bytes_read / (1024.0*1024.0) / max(best, 1e-9)))
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+            description='Measure hashing throughput (MB/s) over a directory.')
+    parser.add_argument('directory')
+    parser.add_argument('--algorithm', action='append', choices=ALGORITHMS,
+            help='algorithm to benchmark (may be repeated, default: all)')
+    parser.add_argument('--threads', type=int, action='append',
+            help='thread count to benchmark (may be repeated, default: 1 and 4)')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='runs per configuration, the fastest is reported')
+    args = parser.parse_args()
+
+    for algorithm, threads, rate in benchmark(args.directory,
+                                              args.algorithm or ALGORITHMS,
+                                              args.threads or [1, 4],
+                                              repeat=args.repeat):
+        print('%-8s threads=%-3d %10.1f MB/s' % (algorithm, threads, rate))
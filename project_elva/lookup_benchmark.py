@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+from database import make_engine
+from datetime import datetime, timedelta
+from migrate import upgrade
+from models import Base, Instance
+from sqlalchemy import select
+
+FILL_BATCH = 20000
+LOOKUP_BATCH = 500
+
+def make_guid(n):
+    return hashlib.sha1(str(n).encode('ascii')).hexdigest()
+
+def fill(engine, start, stop):
+    """
+    Insert instances start to stop-1 with GUIDs spread the way real
+    hashes are.
+
+    """
+
+    table = Instance.__table__
+    start_time = datetime(2017, 4, 1)
+    for first in range(start, stop, FILL_BATCH):
+        rows = [{'guid': make_guid(n),
+                 'student_id': 100000 + n % 5000,
+                 'session_id': 1 + n % 100,
+                 'start_time': start_time,
+                 'end_time': start_time + timedelta(minutes=30),
+                 'audio_files': []}
+                for n in range(first, min(first + FILL_BATCH, stop))]
+        with engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+
+def drop_indexes(engine):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(bind=engine)
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+            'lookups': len(samples),
+            'mean_ms': round(1000.0 * sum(samples) / len(samples), 3),
+            'p50_ms': round(1000.0 * samples[len(samples) // 2], 3),
+            'p99_ms': round(1000.0 * samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+            'max_ms': round(1000.0 * samples[-1], 3)
+    }
+
+def sample_guids(size, count, offset=0):
+    """
+    Return count GUIDs to look up in a table of size instances, half of
+    them present and half not, as for instances not yet ingested.
+
+    """
+
+    step = max(1, size // count)
+    return [make_guid((n + offset) * step % size if n % 2 == 0 else size + n + offset)
+            for n in range(count)]
+
+def time_lookups(engine, size, lookups):
+    """
+    Time single GUID lookups the way Processor.is_duplicate() makes
+    them and batched lookups the way BatchWriter.write() makes them.
+
+    """
+
+    table = Instance.__table__
+    single = []
+    batched = []
+    with engine.connect() as conn:
+        for guid in sample_guids(size, lookups):
+            start = time.time()
+            conn.execute(select([table.c.id]).where(table.c.guid == guid)).first()
+            single.append(time.time() - start)
+
+        for n in range(max(1, lookups // 20)):
+            batch = sample_guids(size, LOOKUP_BATCH, offset=n)
+            start = time.time()
+            conn.execute(select([table.c.guid]).where(table.c.guid.in_(batch))).fetchall()
+            batched.append(time.time() - start)
+    return {'single': summary(single), 'batch_%d' % LOOKUP_BATCH: summary(batched)}
+
+def run(database_url, sizes, lookups):
+    """
+    Grow the instances table through each size, timing GUID lookups
+    without the indexes, then the migration that adds them, then the
+    lookups again. Return a dict of results per size.
+
+    """
+
+    engine = make_engine(database_url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    results = {}
+    filled = 0
+    for size in sorted(sizes):
+        # start each size from a database as it was before the indexes
+        drop_indexes(engine)
+        fill(engine, filled, size)
+        filled = size
+
+        result = {'unindexed': time_lookups(engine, size, lookups)}
+        start = time.time()
+        upgrade(engine)
+        result['migration_seconds'] = round(time.time() - start, 3)
+        result['indexed'] = time_lookups(engine, size, lookups)
+        results[str(size)] = result
+
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+            description='Time instance GUID lookups as the instances table grows, '
+                        'before and after the indexes migrate.py adds.')
+    parser.add_argument('--database-url',
+            help='database to run against (a temporary SQLite file by default); '
+                 'every ELVA table in it is dropped')
+    parser.add_argument('--output', default='lookup-benchmark.json')
+    parser.add_argument('--sizes', type=int, nargs='+',
+            default=[10000, 100000, 1000000],
+            help='instance counts to time lookups at')
+    parser.add_argument('--lookups', type=int, default=200,
+            help='GUID lookups timed at each size')
+    args = parser.parse_args()
+
+    temp_dir = None
+    database_url = args.database_url
+    if database_url is None:
+        temp_dir = tempfile.mkdtemp(prefix='elva-bench-')
+        database_url = 'sqlite:///' + os.path.join(temp_dir, 'lookup.db')
+
+    try:
+        results = {
+                'timestamp': str(datetime.utcnow())[:-7],
+                'python': platform.python_version(),
+                'config': vars(args).copy(),
+                'sizes': run(database_url, args.sizes, args.lookups)
+        }
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir)
+
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, sort_keys=True, indent=4, separators=[', ', ': '])
+
+    print('%10s %-10s %12s %12s %16s' % ('instances', 'indexes', 'p50 ms', 'p99 ms',
+                                         'batch p50 ms'))
+    for size in sorted(results['sizes'], key=int):
+        result = results['sizes'][size]
+        for state in ['unindexed', 'indexed']:
+            lookups = result[state]
+            print('%10s %-10s %12.3f %12.3f %16.3f' % (size, state,
+                    lookups['single']['p50_ms'], lookups['single']['p99_ms'],
+                    lookups['batch_%d' % LOOKUP_BATCH]['p50_ms']))
+        print('%10s migration %.3f s' % (size, result['migration_seconds']))
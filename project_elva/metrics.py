@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+##################
+# Miscellaneous
+##################
+
+PROMETHEUS_PREFIX = 'elva_'
+
+class Metrics(object):
+    '''
+    Class that accumulates per-stage timers and plain counters for an
+    ingestion run. Snapshots are plain dicts, so that worker processes
+    can send theirs back to the parent to be merged.
+
+    '''
+
+    def __init__(self):
+        self.counters = {}
+        self.started = time.time()
+        self.timers = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        """
+        Add a value to a counter.
+
+        """
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, stage, seconds, calls=1):
+        """
+        Add time spent in a stage.
+
+        """
+
+        with self._lock:
+            timer = self.timers.setdefault(stage, [0, 0.0])
+            timer[0] += calls
+            timer[1] += seconds
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - start)
+
+    def timed(self, stage, iterable):
+        """
+        Yield the items of an iterable, charging the time spent waiting
+        for each one to a stage.
+
+        """
+
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.record(stage, time.time() - start, calls=0)
+                return
+            self.record(stage, time.time() - start)
+            yield item
+
+    def snapshot(self, reset=False):
+        """
+        Return the counters and timers as a dict, optionally zeroing
+        them so that the next snapshot only holds what came after.
+
+        """
+
+        with self._lock:
+            state = {
+                    'counters': dict(self.counters),
+                    'timers': dict((stage, list(timer)) for stage, timer
+                                   in self.timers.items())
+            }
+            if reset:
+                self.counters = {}
+                self.timers = {}
+        return state
+
+    def merge(self, state):
+        """
+        Add a snapshot taken in another process.
+
+        """
+
+        for name, value in state['counters'].items():
+            self.count(name, value)
+        for stage, (calls, seconds) in state['timers'].items():
+            self.record(stage, seconds, calls)
+
+    def to_json(self):
+        """
+        Return the metrics as a JSON document.
+
+        """
+
+        state = self.snapshot()
+        return json.dumps({
+                'started': self.started,
+                'updated': time.time(),
+                'counters': state['counters'],
+                'stages': dict((stage, {'calls': calls, 'seconds': round(seconds, 6)})
+                               for stage, (calls, seconds) in state['timers'].items())
+        }, sort_keys=True, indent=4, separators=[', ', ': '])
+
+    def to_prometheus(self):
+        """
+        Return the metrics in the Prometheus text exposition format, for
+        the node exporter's textfile collector.
+
+        """
+
+        state = self.snapshot()
+        lines = [
+                '# HELP %sstage_seconds_total Time spent in each ingestion stage.' % PROMETHEUS_PREFIX,
+                '# TYPE %sstage_seconds_total counter' % PROMETHEUS_PREFIX
+        ]
+        for stage in sorted(state['timers']):
+            lines.append('%sstage_seconds_total{stage="%s"} %.6f' %
+                         (PROMETHEUS_PREFIX, stage, state['timers'][stage][1]))
+        lines.extend([
+                '# HELP %sstage_calls_total Number of calls to each ingestion stage.' % PROMETHEUS_PREFIX,
+                '# TYPE %sstage_calls_total counter' % PROMETHEUS_PREFIX
+        ])
+        for stage in sorted(state['timers']):
+            lines.append('%sstage_calls_total{stage="%s"} %d' %
+                         (PROMETHEUS_PREFIX, stage, state['timers'][stage][0]))
+        for name in sorted(state['counters']):
+            lines.extend([
+                    '# TYPE %s%s_total counter' % (PROMETHEUS_PREFIX, name),
+                    '%s%s_total %d' % (PROMETHEUS_PREFIX, name, state['counters'][name])
+            ])
+        lines.extend([
+                '# TYPE %srun_start_timestamp_seconds gauge' % PROMETHEUS_PREFIX,
+                '%srun_start_timestamp_seconds %.3f' % (PROMETHEUS_PREFIX, self.started),
+                '# TYPE %slast_export_timestamp_seconds gauge' % PROMETHEUS_PREFIX,
+                '%slast_export_timestamp_seconds %.3f' % (PROMETHEUS_PREFIX, time.time())
+        ])
+        return '\n'.join(lines) + '\n'
+
+class MetricsExporter(object):
+    '''
+    Class that writes a Metrics object to a Prometheus textfile and/or
+    a JSON file every interval seconds, and once more when stopped.
+
+    '''
+
+    def __init__(self, metrics, textfile=None, json_file=None, interval=60):
+        self.interval = interval
+        self.json_file = json_file
+        self.metrics = metrics
+        self.textfile = textfile
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def export(self):
+        """
+        Write both files, replacing them atomically so that a collector
+        never reads a partial file.
+
+        """
+
+        for path, render in [(self.textfile, self.metrics.to_prometheus),
+                             (self.json_file, self.metrics.to_json)]:
+            if not path:
+                continue
+            with open(path+'.tmp', 'w') as fp:
+                fp.write(render())
+            os.rename(path+'.tmp', path)
+
+    def start(self):
+        if self.interval and self.interval > 0:
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.export()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.export()
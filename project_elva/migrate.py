@@ -0,0 +1,121 @@
+import argparse
+from database import get_engine
+from models import Base, Rollup
+from rollup import rebuild_rollups
+from sqlalchemy import func, inspect, select
+
+def remove_duplicates(conn, table, columns):
+    """
+    Delete every row of a table that repeats the values of the given
+    columns, keeping the row with the lowest id. Return the number of
+    rows deleted.
+
+    """
+
+    duplicates = select([func.count()]).\
+                 select_from(select(columns).\
+                             group_by(*columns).\
+                             having(func.count() > 1).\
+                             alias('duplicates'))
+    if not conn.execute(duplicates).scalar():
+        return 0
+
+    keep = select([func.min(table.c.id)]).group_by(*columns)
+    doomed = select([table.c.id]).where(~table.c.id.in_(keep))
+    # sqlite does not enforce ON DELETE CASCADE, so remove those rows here
+    for other in Base.metadata.sorted_tables:
+        for fk in other.foreign_keys:
+            if fk.column.table is table and fk.ondelete == 'CASCADE':
+                conn.execute(other.delete().where(fk.parent.in_(doomed)))
+    return conn.execute(table.delete().where(~table.c.id.in_(keep))).rowcount
+
+def missing_indexes(engine):
+    """
+    Return the indexes defined on the models that the database does
+    not have yet.
+
+    """
+
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            # create_all() builds the indexes of new tables itself
+            continue
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        missing.extend(index for index in sorted(table.indexes, key=lambda index: index.name)
+                       if index.name not in existing)
+    return missing
+
+def upgrade(engine=None, dry_run=False):
+    """
+    Bring an existing database up to date with the models: create the
+    missing tables and indexes, first removing the duplicate rows that
+    would stop a unique index being built, and fill a new rollups
+    table. Return a list describing each change.
+
+    """
+
+    if engine is None:
+        engine = get_engine()
+
+    changes = []
+    tables = set(inspect(engine).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            changes.append('create table %s' % table.name)
+    if not dry_run:
+        Base.metadata.create_all(bind=engine, checkfirst=True)
+
+    for index in missing_indexes(engine):
+        columns = list(index.columns)
+        if index.unique:
+            with engine.begin() as conn:
+                if dry_run:
+                    # count the surplus rows without deleting them
+                    count = conn.execute(select([func.count()]).select_from(index.table)).scalar() - \
+                            conn.execute(select([func.count()]).select_from(
+                                    select(columns).distinct().alias('rows'))).scalar()
+                else:
+                    count = remove_duplicates(conn, index.table, columns)
+            if count:
+                changes.append('delete %d duplicate rows from %s'
+                               % (count, index.table.name))
+
+        changes.append('create %sindex %s on %s (%s)'
+                       % ('unique ' if index.unique else '', index.name,
+                          index.table.name, ', '.join(column.name for column in columns)))
+        if not dry_run:
+            index.create(bind=engine)
+
+    # a new rollups table starts empty; ingestion only refreshes the
+    # keys it touches
+    if Rollup.__tablename__ not in tables:
+        changes.append('fill table %s from instances' % Rollup.__tablename__)
+        if not dry_run:
+            with engine.begin() as conn:
+                rebuild_rollups(conn)
+    return changes
+
+def main(argv=None, prog=None):
+    """
+    Upgrade the database with command line arguments.
+
+    """
+
+    parser = argparse.ArgumentParser(prog=prog,
+            description='Add the tables and indexes an existing ELVA database is missing.')
+    parser.add_argument('--dry-run', action='store_true',
+            help='list the changes without making them')
+    args = parser.parse_args(argv)
+
+    changes = upgrade(dry_run=args.dry_run)
+    for change in changes:
+        print(change)
+    if not changes:
+        print('database is up to date')
+
+if __name__ == "__main__":
+    main()
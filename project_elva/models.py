@@ -1,13 +1,73 @@
+import json
 from datetime import datetime
-from sqlalchemy import Column
-from sqlalchemy import DateTime, Integer, String
+from sqlalchemy import Column, Index
+from sqlalchemy import (BigInteger, Boolean, DateTime,
+        Float, Integer, String, Text
+)
 from sqlalchemy import ForeignKey
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 
 Base = declarative_base()
 
+class AudioList(TypeDecorator):
+    '''
+    Class representing a list of audio file names, stored as a native
+    ARRAY on Postgres and as JSON text on any other database.
+
+    '''
+
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.ARRAY(String(1000)))
+        return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        return json.loads(value)
+
+class AudioFile(Base):
+    '''
+    Class representing the table containing the audio files recorded in
+    each instance. Files named in a log but missing from disk are kept
+    with no size (and not counted as null), so they can be found.
+
+    '''
+
+    __tablename__ = 'audio_files'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    instance_id = Column(Integer, ForeignKey('instances.id', ondelete='CASCADE'),
+                         nullable=False)
+    name = Column(String(1000), nullable=False)
+    is_null = Column(Boolean, nullable=False, default=False)
+    size = Column(BigInteger)
+    duration = Column(Float)
+
+    instance = relationship('Instance', back_populates='recordings')
+
+    # null rates per student or session join through the instances
+    # table, then count from this index alone
+    __table_args__ = (
+            Index('ix_audio_files_instance_id_is_null', 'instance_id', 'is_null'),
+    )
+
+    def __init__(self, **kwargs):
+        super(AudioFile, self).__init__(**kwargs)
+
+    def __repr__(self):
+        return '<AudioFile %r>' % self.name
+
 class Computer(Base):
     '''
     Class representing the table containing the computers.
@@ -16,7 +76,7 @@ class Computer(Base):
 
     __tablename__ = 'computers'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    guid = Column(String(8), nullable=False)
+    guid = Column(String(8), nullable=False, index=True)
 
     students = relationship('Student', back_populates='computer')
 
@@ -34,17 +94,19 @@ class Instance(Base):
 
     __tablename__ = 'instances'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    guid = Column(String(1000), nullable=False)
+    guid = Column(String(1000), nullable=False, index=True, unique=True)
     computer = Column(String(8))
-    student_id = Column(Integer, ForeignKey('students.id'))
-    session_id = Column(Integer, ForeignKey('sessions.id'))
+    student_id = Column(Integer, ForeignKey('students.id'), index=True)
+    session_id = Column(Integer, ForeignKey('sessions.id'), index=True)
     start_time = Column(DateTime, nullable=False)
     end_time = Column(DateTime, nullable=False)
     null_audio_count = Column(Integer, default=0)
     total_audio_count = Column(Integer, default=0)
     slides_finished = Column(Integer, default=0)
-    audio_files = Column(postgresql.ARRAY(String(1000)), default=[])
+    audio_files = Column(AudioList, default=[])
 
+    recordings = relationship('AudioFile', back_populates='instance',
+                              passive_deletes=True)
     session = relationship('Session', back_populates='instance') 
     student = relationship('Student', back_populates='instances')
 
@@ -54,6 +116,34 @@ class Instance(Base):
     def __repr__(self):
         return '<Instance %r>' % self.guid
 
+class Rollup(Base):
+    '''
+    Class representing the table of per-student, per-session totals,
+    refreshed from the instances table as instances are ingested.
+
+    '''
+
+    __tablename__ = 'rollups'
+    student_id = Column(Integer, ForeignKey('students.id'), primary_key=True)
+    session_id = Column(Integer, ForeignKey('sessions.id'), primary_key=True,
+                        index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    first_attempt = Column(DateTime)
+    latest_attempt = Column(DateTime)
+    best_slides_finished = Column(Integer)
+    total_duration = Column(Float)
+    null_audio_count = Column(Integer)
+    total_audio_count = Column(Integer)
+
+    session = relationship('Session')
+    student = relationship('Student')
+
+    def __init__(self, **kwargs):
+        super(Rollup, self).__init__(**kwargs)
+
+    def __repr__(self):
+        return '<Rollup %r %r>' % (self.student_id, self.session_id)
+
 class School(Base):
     '''
     Class representing the table containing the schools.
@@ -62,7 +152,7 @@ class School(Base):
 
     __tablename__ = 'schools'
     id = Column(Integer, primary_key=True)
-    name = Column(String(1000), nullable=False)
+    name = Column(String(1000), nullable=False, index=True)
 
     teachers = relationship('Teacher', back_populates='school')
 
@@ -81,7 +171,7 @@ class Session(Base):
     __tablename__ = 'sessions'
     id = Column(Integer, primary_key=True, autoincrement=True)
     unit_id = Column(Integer, ForeignKey('units.id'))
-    name = Column(String(1000), nullable=False)
+    name = Column(String(1000), nullable=False, index=True)
     slides = Column(Integer, nullable=False)
 
     instance = relationship('Instance', back_populates='session')
@@ -143,7 +233,7 @@ class Unit(Base):
 
     __tablename__ = 'units'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    name = Column(String(1000), nullable=False)
+    name = Column(String(1000), nullable=False, index=True)
 
     session = relationship('Session', back_populates='unit')
 
@@ -1,37 +1,24 @@
-import hashlib
-import logging
-import logging.handlers
+import argparse
+import multiprocessing
 import os
 import re
-import sndhdr
-from datetime import datetime
+import signal
+from archive import ArchiveReader
+from audio import AudioValidator, null_files
+from database import dispose_engine, session
+from discovery import PART_SUFFIX, iter_instances
+from eventlog import EventLogger, start_logging
+from follow import Follower
 from glob import glob
-from models import (Base, 
-        Instance, Session,
-        Student
-)
-from sqlalchemy import create_engine
-from sqlalchemy import exc
-from sqlalchemy.engine.url import URL
-from sqlalchemy.orm import sessionmaker
-from tqdm import *
-
-##################
-# Database  
-##################
-
-db_url = {
-        'drivername': 'postgresql',
-        'database': os.environ['POSTGRES_DB'],
-        'username': os.environ['POSTGRES_USER'],
-        'password': os.environ['POSTGRES_PASSWORD'],
-        'host': 'localhost',
-        'port': 5432
-}
-engine = create_engine(URL(**db_url))
-
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+from hashing import ALGORITHMS, HashEngine
+from metrics import Metrics, MetricsExporter
+from models import AudioFile, Instance
+from scanner import LogScan, LogScanner, parse_timestamp
+from rollup import refresh_rollups
+from roster import Roster
+from state import CheckpointStore, FingerprintStore, stat_fingerprint
+from writer import BatchWriter, audio_rows
+from tqdm import tqdm
 
 ##################
 # Logging
@@ -39,62 +26,43 @@ session = DBSession()
 
 LOG_FILENAME = '/home/elva/data-processing/log/log-processor.log'
 
-proc_logger = logging.getLogger('proc-logger')
-proc_logger.setLevel(logging.DEBUG)
-handler = logging.handlers.RotatingFileHandler(
-            LOG_FILENAME,
-            maxBytes=5*1024*1024,
-            backupCount=5 )
-proc_logger.addHandler(handler)
+# records are written as JSON lines by a background thread that
+# main() starts, so importing this module has no side effects
+proc_logger = EventLogger('proc-logger')
 
 ##################
 # Miscellaneous 
 ##################
 
-BUFFER_SIZE = 65536
+CHECKPOINT_DB = os.path.join(os.path.dirname(LOG_FILENAME), 'checkpoints.db')
+FINGERPRINT_DB = os.path.join(os.path.dirname(LOG_FILENAME), 'fingerprints.db')
+METRICS_JSON = os.path.join(os.path.dirname(LOG_FILENAME), 'log-processor.json')
+METRICS_TEXTFILE = os.path.join(os.path.dirname(LOG_FILENAME), 'log-processor.prom')
 SOURCE_LOG_DIR = '/mnt/volume-nyc1-01-part1/OWL-elva-home/logs/PilotStudy/Vivianne/'
 
-##################
-# Regexes 
-##################
-
-AUDIO_REGEXP = re.compile('.*\.au')
-COMP_REGEXP = re.compile('Computer\sName:\s[\d]{2}-[\d]{5}')
-INSTANCE_REGEXP = re.compile('[a-zA-Z]+_[\d]_[\d]{6}_[\d]{2}-[\d]{2}-[\d]{4}')
-TIMESTAMP_REGEXP = re.compile('[\d]{2}\/[\d]{2}\/[\d]{4}\s[\d]{2}:[\d]{2}:[\d]{2}')
-XML_LOAD_REGEXP = re.compile('XML\/ELVA_[\w]+-[\w]+_[\w]+\.xml')
-XML_COMPLETE_REGEXP = re.compile('\*\*\*\sSLIDE\sCOMPLETED\s\*\*\*')
-
 class Processor(object):
 
-    def __init__(self, root_log_dir):
+    def __init__(self, root_log_dir, roster, fingerprints=None,
+                 audio_threads=8, hasher=None, checkpoints=None,
+                 metrics=None):
         self.root = root_log_dir
+        self.audio = AudioValidator(audio_threads)
+        self.checkpoints = checkpoints
+        self.fingerprints = fingerprints
+        self.hasher = hasher or HashEngine()
+        self.metrics = metrics or Metrics()
+        self.roster = roster
+        self.scanner = LogScanner()
+        self._scans = {}
+
+    @property
+    def instances(self):
+        """
+        Return a generator over the instance directories below the root.
+
+        """
 
-        self.instances = []
-        for roots, dirs, files in os.walk(self.root):
-            if INSTANCE_REGEXP.search(roots):
-                if not re.search('000000', roots):
-                    if not os.path.exists(roots+'.txt'):
-                        proc_logger.debug(
-                                str(datetime.utcnow())[:-7]+ \
-                                ' [WARNING] '+ \
-                                roots+'.txt does not exist.'
-                        )
-                        continue
-                    if not os.path.exists(roots+'.log'):
-                        proc_logger.debug(
-                                str(datetime.utcnow())[:-7]+ \
-                                ' [WARNING] '+ \
-                                roots+'.log does not exist.'
-                        )
-                        continue
-                   
-                    proc_logger.debug(
-                            str(datetime.utcnow())[:-7]+ \
-                            ' [INFO] '+ \
-                            roots.split('/')[-1]+' was added to queue.'
-                    )
-                    self.instances.append(roots)
+        return self.metrics.timed('discovery', iter_instances(self.root))
 
     def get_audio(self, log_file):
         """
@@ -102,13 +70,8 @@ class Processor(object):
 
         """
         
-        audio = []
-        with open(log_file, 'r') as fp:
-            for line in fp:
-                res = AUDIO_REGEXP.search(line)
-                if res:
-                    audio.append(res.group(0).split()[-1])
-        return audio
+        with self.metrics.timer('get_audio'):
+            return list(self.scan_log(log_file).audio)
 
     def get_computer(self, text_file):
         """
@@ -117,14 +80,10 @@ class Processor(object):
 
         """
 
-        computer = None
-        with open(text_file, 'r') as fp:
-            for line in fp:
-                res = COMP_REGEXP.search(line)
-                if res:
-                    computer = res.group(0)[-8:]
-                    break
-        return computer
+        with self.metrics.timer('get_computer'):
+            if text_file not in self._scans:
+                self._scans[text_file] = self.scanner.scan_text(text_file)
+            return self._scans[text_file]
 
     def get_logs(self, instance_path):
         """
@@ -137,30 +96,32 @@ class Processor(object):
         for path in instance_files:
             if not os.path.isdir(path):
                 if re.search('\.log', path) and not \
-                   re.search('\.lck', path):
+                   re.search('\.lck', path) and not \
+                   path.endswith(PART_SUFFIX):
                     log_files.append(path)
         return log_files
 
-    def get_null_audio(self, instance_path, audio_list):
+    def get_audio_files(self, instance_path, audio_list):
         """
-        Return a list of the null audio files associated with an instance. 
+        Return the null audio files associated with an instance, and a
+        (name, is_null, size, duration) tuple for each file found.
 
         """
 
-        null_audio = []
-        for item in audio_list:
-            if not os.path.isfile(instance_path+'/'+item):
-                proc_logger.debug(
-                        str(datetime.utcnow())[:-7]+ \
-                        ' [WARNING] '+ \
-                        'detected missing/deleted audio file - '+ \
-                        instance_path.split('/')[-1]
-                ) 
-                continue
-            res = sndhdr.what(instance_path+'/'+item)
-            if res is None:
-                null_audio.append(item)
-        return null_audio
+        with self.metrics.timer('get_audio_files'):
+            files, missing = self.audio.describe(instance_path, audio_list)
+        self.warn_missing(instance_path, missing)
+        return null_files(audio_list, files), files
+
+    def warn_missing(self, instance_path, missing):
+        """
+        Log a warning for each audio file named in a log that is missing.
+
+        """
+
+        for item in missing:
+            proc_logger.warning('audio_missing', instance_path.split('/')[-1],
+                    'detected missing/deleted audio file %s', item)
 
     def get_slides(self, log_file):
         """
@@ -168,13 +129,8 @@ class Processor(object):
 
         """
 
-        slides = []
-        with open(log_file, 'r') as fp:
-            for line in fp:
-                res = XML_LOAD_REGEXP.search(line)
-                if res:
-                    slides.append(res.group(0)[4:])
-        return list(set(slides))
+        with self.metrics.timer('get_slides'):
+            return list(self.scan_log(log_file).slides)
 
     def get_times(self, log_file):
         """
@@ -182,13 +138,11 @@ class Processor(object):
 
         """
 
-        timestamps = []
-        with open(log_file, 'r') as fp:
-            for line in fp:
-                res = TIMESTAMP_REGEXP.match(line)
-                if res:
-                    timestamps.append(res.group(0))
-        return [timestamps[0], timestamps[-1]]
+        with self.metrics.timer('get_times'):
+            scan = self.scan_log(log_file)
+        if scan.start_time is None:
+            raise IndexError('no timestamps found in '+log_file)
+        return [scan.start_time, scan.end_time]
 
     def hash_dir(self, dir_path):
         """
@@ -196,14 +150,7 @@ class Processor(object):
 
         """
 
-        file_hashes = []
-        for path, dirs, files in os.walk(dir_path):
-            for item in sorted(files):
-                file_hashes.append(self.hash_file(os.path.join(path, item)))
-            for item in sorted(dirs):
-                file_hashes.append(self.hash_dir(os.path.join(path, item)))
-            break
-        return str(hashlib.sha1(''.join(file_hashes)).hexdigest())
+        return self.hasher.hash_dir(dir_path)
 
     def hash_file(self, file_path):
         """
@@ -211,11 +158,7 @@ class Processor(object):
 
         """
 
-        hash_sha1 = hashlib.sha1()
-        with open(file_path, 'rb') as fp:
-            for chunk in iter(lambda: fp.read(BUFFER_SIZE), b""):
-                hash_sha1.update(chunk)
-        return hash_sha1.hexdigest()
+        return self.hasher.hash_file(file_path)
 
     def hash_instance(self, instance_files):
         """
@@ -223,92 +166,472 @@ class Processor(object):
 
         """
 
-        hash_list = []
-        if os.path.isdir(instance_files[0]):
-            hash_list.append(self.hash_dir(instance_files[0]))
-        if os.path.isfile(instance_files[1]):
-            hash_list.append(self.hash_file(instance_files[1]))
-        if os.path.isfile(instance_files[2]):
-            hash_list.append(self.hash_file(instance_files[2]))
+        bytes_read = self.hasher.bytes_read
+        with self.metrics.timer('hash_instance'):
+            instance_hash = self.hasher.hash_instance(instance_files)
+        self.metrics.count('bytes_hashed', self.hasher.bytes_read - bytes_read)
+        return instance_hash
 
-        return str(hashlib.sha1(''.join(hash_list)).hexdigest())
+    def scan_log(self, log_file):
+        """
+        Return the LogScan for a log file, reading the file only once.
 
-    def process(self, instance_path):
         """
-        Insert each instance into the database.
+
+        if log_file not in self._scans:
+            bytes_read = self.scanner.bytes_read
+            with self.metrics.timer('scan_log'):
+                self._scans[log_file] = self.scanner.scan(log_file,
+                        resume=self.load_checkpoint(log_file))
+            self.metrics.count('bytes_scanned', self.scanner.bytes_read - bytes_read)
+        return self._scans[log_file]
+
+    def load_checkpoint(self, log_file):
+        """
+        Return the LogScan saved for a log file by an earlier run, or None.
+
+        """
+
+        if self.checkpoints is None:
+            return None
+        state = self.checkpoints.load(log_file)
+        if state is None:
+            return None
+        return LogScan.from_dict(state)
+
+    def checkpoint(self, log_file):
+        """
+        Scan the complete lines of a log that is still being written and
+        save the result, so that later runs only read what is appended.
 
         """
 
-        log_files = self.get_logs(instance_path)
+        proc_logger.info('log_locked', log_file.split('/')[-1],
+                'log is still being written')
+        if self.checkpoints is None:
+            return
+        scan = self.scanner.scan(log_file,
+                resume=self.load_checkpoint(log_file),
+                partial=True)
+        self.checkpoints.save(log_file, scan.to_dict())
 
-        # get data that are independent of the log file
-        session_name = '_'.join(instance_path.split('/')[-1].split('_')[:2])
-        student_id = instance_path.split('/')[-1].split('_')[2]
+    def extract(self, instance_path):
+        """
+        Return a list of records (one per log file) containing everything
+        about an instance that can be gathered without the database. The
+        instance is expected to have been accepted already.
+
+        """
 
-        for log in enumerate(log_files):
-            instance_files = [instance_path, log[1], instance_path+'.txt']
+        records = []
+        for log_file, instance_files, fingerprint in self.changed_logs(instance_path):
             instance_hash = self.hash_instance(instance_files)
+            try:
+                record = self.extract_log(instance_files, instance_hash)
+            except IndexError:
+                # one unreadable log must not abort a whole backfill
+                proc_logger.warning('timestamps_missing', instance_path.split('/')[-1],
+                        'no timestamps found in %s', log_file)
+                continue
+            record['fingerprint'] = fingerprint
+            records.append(record)
+        self._scans.clear()
+        return records
+
+    def extract_archive(self, archive_path):
+        """
+        Return a list of records for every accepted instance inside a
+        .tar.gz or .zip archive, read in one pass without extracting it.
+        GUIDs are the same as for the extracted instance.
 
-            result = session.query(Instance).filter_by(guid=instance_hash).first() 
-            if result is None: 
-                # get data that are dependent on the log file
-                audio = self.get_audio(log[1])
-                computer = self.get_computer(instance_files[2])
-                null_audio = self.get_null_audio(instance_path, audio)
-                slides = self.get_slides(log[1])
-                start_time, end_time = self.get_times(log[1])
-
-                sess = session.query(Session).filter_by(name=session_name).first()
-                if sess is not None:
-                    stud = session.query(Student).filter_by(id=student_id).first()
-                    if stud is None:
-                        proc_logger.debug(
-                                str(datetime.utcnow())[:-7]+ \
-                                ' [WARNING] '+ \
-                                'student ID ' + str(student_id) + ' does not exist in table.'
-                        )
-                        continue
-                    
-                    inst = Instance(
-                            guid=instance_hash,
-                            computer=computer,
-                            student_id=student_id,
-                            session_id=sess.id,
-                            start_time=datetime.strptime(start_time, '%d/%m/%Y %H:%M:%S'),
-                            end_time=datetime.strptime(end_time, '%d/%m/%Y %H:%M:%S'),
-                            null_audio_count=len(null_audio),
-                            total_audio_count=len(audio),
-                            slides_finished=len(slides),
-                            audio_files=audio
-                    )
-                    session.add(inst)
-
-                    proc_logger.debug(
-                            str(datetime.utcnow())[:-7]+ \
-                            ' [INFO] successfully added instance '+ \
-                            instance_path.split('/')[-1]
-                    )
-
-                else:
-                    proc_logger.debug(
-                            str(datetime.utcnow())[:-7]+ \
-                            ' [WARNING] '+ \
-                            'session name was unable to be identified - '+ \
-                            instance_path.split('/')[-1]
-                    )
+        """
+
+        reader = ArchiveReader(archive_path,
+                algorithm=self.hasher.algorithm,
+                accept=self.accept)
+        with self.metrics.timer('archive_read'):
+            reader.read()
+
+        records = []
+        for instance in reader.instances():
+            instance_path = archive_path+'/'+instance
+            session_name, student_id = parse_instance_name(instance_path)
+
+            for log_name in reader.logs(instance):
+                scan = reader.scans[log_name]
+                if scan.start_time is None:
+                    proc_logger.warning('timestamps_missing', instance.split('/')[-1],
+                            'no timestamps found in %s/%s', archive_path, log_name)
                     continue
-            else:
-                proc_logger.debug(
-                        str(datetime.utcnow())[:-7]+ \
-                        ' [WARNING] '+ \
-                        'attempted to add instance with same GUID - '+ \
-                        instance_path.split('/')[-1]
-                )
+
+                files, missing = reader.describe_audio(instance, scan.audio)
+                self.warn_missing(instance_path, missing)
+                records.append({
+                        'guid': reader.hash_instance(instance, log_name),
+                        'instance_path': instance_path,
+                        'log_file': archive_path+'/'+log_name,
+                        'session_name': session_name,
+                        'student_id': student_id,
+                        'computer': reader.computers[instance+'.txt'],
+                        'audio': scan.audio,
+                        'audio_files': files,
+                        'null_audio': null_files(scan.audio, files),
+                        'slides': list(scan.slides),
+                        'start_time': scan.start_time,
+                        'end_time': scan.end_time,
+                        'fingerprint': ''
+                })
+        return records
+
+    def extract_log(self, instance_files, instance_hash):
+        """
+        Return a record of the data that are dependent on a log file.
+
+        """
+
+        instance_path, log_file, text_file = instance_files
+        session_name, student_id = parse_instance_name(instance_path)
+
+        audio = self.get_audio(log_file)
+        null_audio, audio_files = self.get_audio_files(instance_path, audio)
+        start_time, end_time = self.get_times(log_file)
+        return {
+                'guid': instance_hash,
+                'instance_path': instance_path,
+                'log_file': log_file,
+                'session_name': session_name,
+                'student_id': student_id,
+                'computer': self.get_computer(text_file),
+                'audio': audio,
+                'audio_files': audio_files,
+                'null_audio': null_audio,
+                'slides': self.get_slides(log_file),
+                'start_time': start_time,
+                'end_time': end_time
+        }
+
+    def changed_logs(self, instance_path):
+        """
+        Return (log_file, instance_files, fingerprint) for each finished
+        log of an instance that has to be hashed, checkpointing the logs
+        still being written. A log is skipped only if its stat
+        fingerprint is unchanged and the GUID stored with it is still in
+        the database, checked with one query per instance, so instances
+        dropped from the database (e.g. by init-db --drop-all) are
+        inserted again.
+
+        """
+
+        entries = []
+        known = {}
+        for log_file in self.get_logs(instance_path):
+            if os.path.exists(log_file+'.lck'):
+                self.checkpoint(log_file)
                 continue
-        session.commit()
 
-if __name__ == "__main__":
+            instance_files = [instance_path, log_file, instance_path+'.txt']
+            if self.fingerprints is None:
+                entries.append((log_file, instance_files, ''))
+                continue
+            fingerprint = stat_fingerprint(instance_files)
+            guid = self.fingerprints.lookup(log_file, fingerprint)
+            if guid is not None:
+                known[log_file] = guid
+            entries.append((log_file, instance_files, fingerprint))
+
+        stored = set()
+        if known:
+            with self.metrics.timer('db_query'):
+                stored = set(guid for (guid,) in
+                             session.query(Instance.guid).\
+                                     filter(Instance.guid.in_(set(known.values()))))
+
+        changed = []
+        for entry in entries:
+            log_file = entry[0]
+            if log_file in known:
+                if known[log_file] in stored:
+                    self.metrics.count('instances_unchanged')
+                    proc_logger.info('instance_unchanged', log_file.split('/')[-1],
+                            'skipped unchanged instance')
+                    continue
+                self.metrics.count('fingerprints_stale')
+                proc_logger.warning('fingerprint_stale', log_file.split('/')[-1],
+                        'unchanged instance with GUID %s is not in the database',
+                        known[log_file])
+            changed.append(entry)
+        return changed
+
+    def accept(self, instance_path):
+        """
+        Return True if the session and student encoded in an instance
+        path exist, so unknown instances are rejected before any hashing.
+
+        """
+
+        session_name, student_id = parse_instance_name(instance_path)
+
+        if self.roster.session_id(session_name) is None:
+            self.metrics.count('instances_rejected')
+            proc_logger.warning('session_unknown', instance_path.split('/')[-1],
+                    'session name %s was unable to be identified', session_name)
+            return False
+
+        if not self.roster.has_student(student_id):
+            self.metrics.count('instances_rejected')
+            proc_logger.warning('student_unknown', instance_path.split('/')[-1],
+                    'student ID %s does not exist in table.', student_id)
+            return False
+
+        return True
+
+    def insert(self, record):
+        """
+        Add an accepted record to the database session, returning the
+        new Instance.
+
+        """
+
+        inst = Instance(
+                guid=record['guid'],
+                computer=record['computer'],
+                student_id=record['student_id'],
+                session_id=self.roster.session_id(record['session_name']),
+                start_time=parse_timestamp(record['start_time']),
+                end_time=parse_timestamp(record['end_time']),
+                null_audio_count=len(record['null_audio']),
+                total_audio_count=len(record['audio']),
+                slides_finished=len(record['slides']),
+                audio_files=record['audio'],
+                recordings=[AudioFile(**row) for row in audio_rows(record)]
+        )
+        session.add(inst)
+        self.metrics.count('instances_added')
+
+        proc_logger.info('instance_added', record['instance_path'].split('/')[-1],
+                'successfully added instance')
+        return inst
+
+    def is_duplicate(self, instance_path, instance_hash):
+        """
+        Return True (and log a warning) if an instance with the given
+        hash is already in the database.
+
+        """
+
+        with self.metrics.timer('db_query'):
+            result = session.query(Instance).filter_by(guid=instance_hash).first()
+        if result is None:
+            return False
+
+        self.metrics.count('instances_duplicated')
+        proc_logger.warning('instance_duplicate', instance_path.split('/')[-1],
+                'attempted to add instance with same GUID %s', instance_hash)
+        return True
+
+    def process(self, instance_path):
+        """
+        Insert each instance into the database.
+
+        """
+
+        if not self.accept(instance_path):
+            return
+
+        seen = []
+        for log_file, instance_files, fingerprint in self.changed_logs(instance_path):
+            instance_hash = self.hash_instance(instance_files)
+            if self.is_duplicate(instance_path, instance_hash) or \
+               self.insert(self.extract_log(instance_files, instance_hash)):
+                seen.append((log_file, fingerprint, instance_hash))
+        with self.metrics.timer('db_commit'):
+            # flush the new instances so their rollups can be recomputed
+            keys = set((int(inst.student_id), inst.session_id) for inst in session.new
+                       if isinstance(inst, Instance))
+            session.flush()
+            refresh_rollups(session, keys)
+            session.commit()
+        self._scans.clear()
+        self.remember(seen)
+
+    def committed(self, records):
+        """
+        Remember the fingerprints of records written by a BatchWriter.
+
+        """
+
+        self.remember([(record['log_file'], record['fingerprint'],
+                        record['guid']) for record in records])
+
+    def remember(self, seen):
+        """
+        Store the fingerprints of committed instances so that later runs
+        can skip them without hashing, and drop their checkpoints.
 
-    proc = Processor(SOURCE_LOG_DIR)
-    for item in tqdm(proc.instances):
-        proc.process(item)
+        """
+
+        if self.fingerprints is not None:
+            # archive members have no stat fingerprint
+            self.fingerprints.record([entry for entry in seen if entry[1]])
+        if self.checkpoints is not None:
+            self.checkpoints.discard([log_file for log_file, fingerprint, guid in seen])
+
+def parse_instance_name(instance_path):
+    """
+    Return the session name and student ID encoded in an instance path.
+
+    """
+
+    parts = instance_path.split('/')[-1].split('_')
+    return '_'.join(parts[:2]), parts[2]
+
+##################
+# Batched mode
+##################
+
+_worker_proc = None
+
+def _init_worker(processor):
+    global _worker_proc
+    _worker_proc = processor
+    # the parent already holds everything counted before the fork
+    _worker_proc.metrics.snapshot(reset=True)
+
+def _extract_instance(instance_path):
+    records = _worker_proc.extract(instance_path)
+    return records, _worker_proc.metrics.snapshot(reset=True)
+
+def run_batched(proc, writer, workers=1):
+    """
+    Hash and parse instances (in a pool of worker processes if workers
+    is greater than one) and hand the records to a single BatchWriter,
+    so that this process remains the only one that talks to the database.
+
+    """
+
+    instances = (item for item in proc.instances if proc.accept(item))
+
+    if workers <= 1:
+        for item in tqdm(instances):
+            writer.add(proc.extract(item))
+        writer.flush()
+        return
+
+    # load the roster and release every connection before forking, so
+    # that no pooled connections are shared with the workers
+    proc.roster.refresh()
+    session.remove()
+    dispose_engine()
+
+    pool = multiprocessing.Pool(workers, _init_worker, (proc,))
+    try:
+        results = pool.imap_unordered(_extract_instance, instances)
+        for records, metrics in tqdm(results):
+            proc.metrics.merge(metrics)
+            writer.add(records)
+        writer.flush()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def main(argv=None, prog=None):
+    """
+    Run the processor with command line arguments.
+
+    """
+
+    parser = argparse.ArgumentParser(prog=prog,
+            description='Insert ELVA log instances into the database.')
+    parser.add_argument('--follow', action='store_true',
+            help='keep running and process new instances as they land')
+    parser.add_argument('--poll-interval', type=float, default=5,
+            help='seconds between checks of the source tree in --follow mode')
+    parser.add_argument('--settle', type=float, default=30,
+            help='seconds an instance must be unchanged before --follow processes it')
+    parser.add_argument('--source-dir', default=SOURCE_LOG_DIR,
+            help='root of the log tree, e.g. a local mirror kept by `elva sync`')
+    parser.add_argument('--archive', action='append', default=[],
+            help='read instances directly from a .tar.gz or .zip archive '
+                 'instead of the source directory (may be repeated)')
+    parser.add_argument('--workers', type=int, default=1,
+            help='number of worker processes used to hash and parse instances')
+    parser.add_argument('--audio-threads', type=int, default=8,
+            help='number of threads used to read audio file headers')
+    parser.add_argument('--batch-size', type=int, default=1,
+            help='number of instances written to the database per commit')
+    parser.add_argument('--hash-algorithm', default='sha1', choices=ALGORITHMS,
+            help='algorithm used for instance GUIDs (anything but sha1 changes '
+                 'every GUID, so existing instances will no longer be deduplicated)')
+    parser.add_argument('--hash-threads', type=int, default=4,
+            help='number of threads used to hash the files of an instance')
+    parser.add_argument('--checkpoints', default=CHECKPOINT_DB,
+            help='SQLite file holding the scan state of logs still being written')
+    parser.add_argument('--no-checkpoints', action='store_true',
+            help='always read logs from the start')
+    parser.add_argument('--fingerprints', default=FINGERPRINT_DB,
+            help='SQLite file used to skip instances unchanged since the last run')
+    parser.add_argument('--no-fingerprints', action='store_true',
+            help='hash every instance, ignoring and not updating fingerprints')
+    parser.add_argument('--metrics-textfile', default=METRICS_TEXTFILE,
+            help='Prometheus textfile the stage timers and counters are written to')
+    parser.add_argument('--metrics-json', default=METRICS_JSON,
+            help='JSON file the stage timers and counters are written to')
+    parser.add_argument('--metrics-interval', type=float, default=60,
+            help='seconds between metrics exports during a run (0 exports only at the end)')
+    args = parser.parse_args(argv)
+    start_logging('proc-logger', LOG_FILENAME)
+
+    checkpoints = None
+    if not args.no_checkpoints:
+        checkpoints = CheckpointStore(args.checkpoints)
+
+    fingerprints = None
+    if not args.no_fingerprints:
+        fingerprints = FingerprintStore(args.fingerprints)
+
+    roster = Roster(session)
+    # `kill -HUP` reloads the sessions and students tables mid-run
+    signal.signal(signal.SIGHUP, lambda signum, frame: roster.invalidate())
+
+    proc = Processor(args.source_dir, roster,
+            fingerprints=fingerprints,
+            audio_threads=args.audio_threads,
+            hasher=HashEngine(args.hash_algorithm, threads=args.hash_threads),
+            checkpoints=checkpoints,
+            metrics=Metrics())
+    exporter = MetricsExporter(proc.metrics,
+            textfile=args.metrics_textfile,
+            json_file=args.metrics_json,
+            interval=args.metrics_interval).start()
+    try:
+        if args.archive:
+            writer = BatchWriter(session, roster,
+                    batch_size=args.batch_size,
+                    on_commit=proc.committed,
+                    metrics=proc.metrics)
+            for archive_path in tqdm(args.archive):
+                writer.add(proc.extract_archive(archive_path))
+            writer.flush()
+        elif args.follow:
+            follower = Follower(proc, session,
+                    interval=args.poll_interval,
+                    settle=args.settle)
+            signal.signal(signal.SIGTERM, lambda signum, frame: follower.stop())
+            follower.run()
+        elif args.workers > 1 or args.batch_size > 1:
+            writer = BatchWriter(session, roster,
+                    batch_size=args.batch_size,
+                    on_commit=proc.committed,
+                    metrics=proc.metrics)
+            run_batched(proc, writer, workers=args.workers)
+        else:
+            for item in tqdm(proc.instances):
+                proc.process(item)
+    finally:
+        exporter.stop()
+
+if __name__ == "__main__":
+    main()
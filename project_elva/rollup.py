@@ -0,0 +1,129 @@
+import argparse
+import json
+from database import duration_seconds, session
+from models import Instance, Rollup, Session
+from sqlalchemy import func, select
+
+# rollups columns in the order aggregate() selects them
+COLUMNS = ['student_id', 'session_id', 'attempts',
+           'first_attempt', 'latest_attempt', 'best_slides_finished',
+           'total_duration', 'null_audio_count', 'total_audio_count']
+
+def dialect_of(db):
+    # sessions and connections both execute statements, but only
+    # connections know their dialect directly
+    if hasattr(db, 'get_bind'):
+        return db.get_bind().dialect.name
+    return db.dialect.name
+
+def aggregate(dialect_name):
+    """
+    Return a SELECT of the rollup of every (student, session) pair in
+    the instances table.
+
+    """
+
+    inst = Instance.__table__
+    return select([inst.c.student_id, inst.c.session_id,
+                   func.count(inst.c.id),
+                   func.min(inst.c.start_time),
+                   func.max(inst.c.start_time),
+                   func.max(inst.c.slides_finished),
+                   func.sum(duration_seconds(inst.c.start_time, inst.c.end_time,
+                                             dialect_name)),
+                   func.sum(inst.c.null_audio_count),
+                   func.sum(inst.c.total_audio_count)]).\
+           where(inst.c.student_id != None).\
+           where(inst.c.session_id != None).\
+           group_by(inst.c.student_id, inst.c.session_id)
+
+def refresh_rollups(db, keys):
+    """
+    Recompute the rollups of a set of (student_id, session_id) keys from
+    the instances table, in the caller's transaction. Pending ORM
+    changes must be flushed first.
+
+    """
+
+    keys = set(key for key in keys if None not in key)
+    if not keys:
+        return
+
+    # every pair of a touched student and a touched session is
+    # recomputed, which covers the touched keys without tuple IN
+    students = set(student_id for student_id, session_id in keys)
+    sessions = set(session_id for student_id, session_id in keys)
+
+    inst = Instance.__table__
+    table = Rollup.__table__
+    db.execute(table.delete().\
+                     where(table.c.student_id.in_(students)).\
+                     where(table.c.session_id.in_(sessions)))
+    db.execute(table.insert().from_select(COLUMNS,
+            aggregate(dialect_of(db)).\
+            where(inst.c.student_id.in_(students)).\
+            where(inst.c.session_id.in_(sessions))))
+
+def rebuild_rollups(db):
+    """
+    Replace every rollup with one computed from the instances table, in
+    the caller's transaction.
+
+    """
+
+    table = Rollup.__table__
+    db.execute(table.delete())
+    db.execute(table.insert().from_select(COLUMNS, aggregate(dialect_of(db))))
+
+def get_rollup(db_session, student_id=None, session_id=None):
+    """
+    Return a query over the rollups, optionally for one student or one
+    session only.
+
+    """
+
+    query = db_session.query(Rollup)
+    if student_id is not None:
+        query = query.filter(Rollup.student_id == student_id)
+    if session_id is not None:
+        query = query.filter(Rollup.session_id == session_id)
+    return query.order_by(Rollup.student_id, Rollup.session_id)
+
+def main(argv=None, prog=None):
+    """
+    Rebuild or dump the rollups with command line arguments.
+
+    """
+
+    parser = argparse.ArgumentParser(prog=prog,
+            description='Rebuild the per-student, per-session rollups from the '
+                        'instances table, or write them to a JSON file.')
+    parser.add_argument('--rebuild', action='store_true',
+            help='recompute every rollup (ingestion keeps them current)')
+    parser.add_argument('--json',
+            help='write the rollups, with session names, to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        rebuild_rollups(session)
+        session.commit()
+
+    if args.json:
+        rows = session.query(Rollup, Session.name).\
+                       join(Rollup.session).\
+                       order_by(Rollup.student_id, Session.name)
+        data = []
+        for rollup, session_name in rows:
+            entry = dict((column, getattr(rollup, column)) for column in COLUMNS)
+            entry['session_name'] = session_name
+            for column in ['first_attempt', 'latest_attempt']:
+                if entry[column] is not None:
+                    entry[column] = str(entry[column])
+            data.append(entry)
+        with open(args.json, 'w') as fp:
+            json.dump(data, fp, sort_keys=True, indent=4, separators=[', ', ': '])
+
+    print('%d rollups' % session.query(Rollup).count())
+
+if __name__ == "__main__":
+    main()
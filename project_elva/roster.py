@@ -0,0 +1,57 @@
+from models import Session, Student
+
+class Roster(object):
+    '''
+    Class holding the sessions and students tables in memory, so that
+    instances can be validated without a database round trip.
+
+    '''
+
+    def __init__(self, session):
+        self._session = session
+        self.sessions = {}
+        self.stale = True
+        self.students = set()
+
+    def __repr__(self):
+        return '<Roster %d sessions, %d students>' % (len(self.sessions),
+                                                      len(self.students))
+
+    def invalidate(self):
+        """
+        Mark the roster as stale so it is reloaded on next use. This is
+        safe to call from a signal handler.
+
+        """
+
+        self.stale = True
+
+    def refresh(self):
+        """
+        Reload the sessions and students tables.
+
+        """
+
+        self.sessions = dict(self._session.query(Session.name, Session.id))
+        self.students = set(id for (id,) in self._session.query(Student.id))
+        self.stale = False
+
+    def session_id(self, session_name):
+        """
+        Return the ID of a session, or None if it does not exist.
+
+        """
+
+        if self.stale:
+            self.refresh()
+        return self.sessions.get(session_name)
+
+    def has_student(self, student_id):
+        """
+        Return True if a student ID exists in the students table.
+
+        """
+
+        if self.stale:
+            self.refresh()
+        return int(student_id) in self.students
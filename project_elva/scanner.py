@@ -0,0 +1,280 @@
+import binascii
+import mmap
+import os
+import re
+from datetime import datetime
+
+##################
+# Regexes
+##################
+
+AUDIO_REGEXP = re.compile('.*\.au')
+COMP_REGEXP = re.compile('Computer\sName:\s[\d]{2}-[\d]{5}')
+TIMESTAMP_REGEXP = re.compile('[\d]{2}\/[\d]{2}\/[\d]{4}\s[\d]{2}:[\d]{2}:[\d]{2}')
+XML_LOAD_REGEXP = re.compile('XML\/ELVA_[\w]+-[\w]+_[\w]+\.xml')
+XML_COMPLETE_REGEXP = re.compile('\*\*\*\sSLIDE\sCOMPLETED\s\*\*\*')
+
+# bytes versions run over a whole mapped log; none of them may match
+# across a newline, so that each match still belongs to a single line
+AUDIO_BYTES_REGEXP = re.compile(br'(?m)^.*\.au')
+XML_LOAD_BYTES_REGEXP = re.compile(br'XML\/ELVA_[\w]+-[\w]+_[\w]+\.xml')
+XML_COMPLETE_BYTES_REGEXP = re.compile(br'\*\*\*[^\S\n]SLIDE[^\S\n]COMPLETED[^\S\n]\*\*\*')
+
+##################
+# Miscellaneous
+##################
+
+# bytes kept from just before a checkpoint to detect rewritten logs
+CHECKPOINT_TAIL = 64
+# bytes read at a time when looking for the last timestamp of a log
+TIMESTAMP_BLOCK_SIZE = 4096
+# logs with at least this many unread bytes are scanned through mmap
+MMAP_SCAN_THRESHOLD = 16*1024*1024
+
+if bytes is str:
+    def decode(line):
+        return line
+else:
+    def decode(line):
+        return line.decode('utf-8', 'replace')
+
+def parse_timestamp(stamp):
+    """
+    Return the datetime for a 'dd/mm/YYYY HH:MM:SS' log timestamp, read
+    by position rather than with datetime.strptime.
+
+    """
+
+    return datetime(int(stamp[6:10]), int(stamp[3:5]), int(stamp[0:2]),
+                    int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19]))
+
+def first_timestamp(fp, end=None):
+    """
+    Return the first timestamp in a log opened in binary mode, reading
+    only as far as the first line that starts with one.
+
+    """
+
+    fp.seek(0)
+    offset = 0
+    for line in fp:
+        offset += len(line)
+        if end is not None and offset > end:
+            break
+        res = TIMESTAMP_REGEXP.match(decode(line))
+        if res:
+            return res.group(0)
+    return None
+
+def last_timestamp(fp, end, block_size=TIMESTAMP_BLOCK_SIZE):
+    """
+    Return the last timestamp in the first end bytes of a log opened in
+    binary mode, reading fixed-size blocks backwards from end.
+
+    """
+
+    pos = end
+    rest = b''
+    while pos > 0:
+        size = min(block_size, pos)
+        pos -= size
+        fp.seek(pos)
+        lines = (fp.read(size) + rest).split(b'\n')
+        # the first piece may continue a line that started in an earlier block
+        rest = lines.pop(0) if pos > 0 else b''
+        for line in reversed(lines):
+            res = TIMESTAMP_REGEXP.match(decode(line))
+            if res:
+                return res.group(0)
+    return None
+
+class LogScan(object):
+    '''
+    Class representing everything extracted from a single pass over
+    a log file, along with where that pass stopped.
+
+    '''
+
+    def __init__(self):
+        self.audio = []
+        self.completed = []
+        self.current_slide = None
+        self.end_time = None
+        self.inode = None
+        self.offset = 0
+        self.slides = set()
+        self.start_time = None
+        self.tail = ''
+
+    def __repr__(self):
+        return '<LogScan %d audio, %d slides>' % (len(self.audio),
+                                                  len(self.slides))
+
+    @classmethod
+    def from_dict(cls, state):
+        result = cls()
+        result.__dict__.update(state)
+        result.slides = set(state['slides'])
+        return result
+
+    def to_dict(self):
+        state = self.__dict__.copy()
+        state['slides'] = sorted(self.slides)
+        return state
+
+class LogScanner(object):
+
+    def __init__(self, mmap_threshold=MMAP_SCAN_THRESHOLD):
+        self.bytes_read = 0
+        self.mmap_threshold = mmap_threshold
+
+    def scan(self, log_file, resume=None, partial=False):
+        """
+        Return a LogScan built from a single read of a log file. If a
+        LogScan from an earlier pass is given, only the bytes appended
+        since then are read. With partial set, a trailing line without
+        a newline is left for the next pass.
+
+        """
+
+        with open(log_file, 'rb') as fp:
+            st = os.fstat(fp.fileno())
+            if resume is None or not self.can_resume(fp, st, resume):
+                resume = LogScan()
+            if self.mmap_threshold and \
+               st.st_size - resume.offset >= self.mmap_threshold:
+                result = self.scan_mmap(fp, resume, st.st_size, partial)
+            else:
+                fp.seek(resume.offset)
+                result = self.scan_lines(fp, resume, partial, times=False)
+
+            # only the first and last lines with a timestamp matter
+            if result.start_time is None:
+                result.start_time = first_timestamp(fp, result.offset)
+            if result.start_time is not None:
+                result.end_time = last_timestamp(fp, result.offset)
+
+            result.inode = st.st_ino
+            start = max(0, result.offset - CHECKPOINT_TAIL)
+            fp.seek(start)
+            result.tail = binascii.hexlify(fp.read(result.offset - start)).decode('ascii')
+        return result
+
+    def can_resume(self, fp, st, resume):
+        """
+        Return True if a log file still starts with the bytes an earlier
+        pass read, i.e. it has only been appended to since.
+
+        """
+
+        if resume.inode != st.st_ino or resume.offset > st.st_size:
+            return False
+        tail = binascii.unhexlify(str(resume.tail))
+        fp.seek(resume.offset - len(tail))
+        return fp.read(len(tail)) == tail
+
+    def scan_lines(self, lines, result=None, partial=False, times=True):
+        """
+        Return a LogScan built from an iterable of log lines, continuing
+        from an earlier result if one is given. With times unset the
+        lines are not matched against TIMESTAMP_REGEXP.
+
+        """
+
+        if result is None:
+            result = LogScan()
+        for line in lines:
+            # offsets are only tracked for lines read in binary mode
+            if isinstance(line, bytes):
+                if partial and not line.endswith(b'\n'):
+                    break
+                result.offset += len(line)
+                self.bytes_read += len(line)
+                line = decode(line)
+
+            if times:
+                res = TIMESTAMP_REGEXP.match(line)
+                if res:
+                    if result.start_time is None:
+                        result.start_time = res.group(0)
+                    result.end_time = res.group(0)
+
+            res = AUDIO_REGEXP.search(line)
+            if res:
+                result.audio.append(res.group(0).split()[-1])
+
+            res = XML_LOAD_REGEXP.search(line)
+            if res:
+                result.current_slide = res.group(0)[4:]
+                result.slides.add(result.current_slide)
+
+            # record which slide each completion event belongs to
+            if XML_COMPLETE_REGEXP.search(line):
+                result.completed.append(result.current_slide)
+        return result
+
+    def scan_mmap(self, fp, result, size, partial=False):
+        """
+        Continue a LogScan over the rest of a log by running the bytes
+        regexes over a memory map of the file, which gives the same
+        result as scan_lines without splitting the log into lines.
+
+        """
+
+        buf = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = result.offset
+            end = size
+            if partial:
+                end = max(start, buf.rfind(b'\n', start, size) + 1)
+
+            for res in AUDIO_BYTES_REGEXP.finditer(buf, start, end):
+                result.audio.append(decode(res.group(0).split()[-1]))
+
+            # scan_lines looks at the first slide load and at most one
+            # completion per line, and at the load first
+            events = []
+            for kind, regexp in enumerate([XML_LOAD_BYTES_REGEXP,
+                                           XML_COMPLETE_BYTES_REGEXP]):
+                last_line = None
+                for res in regexp.finditer(buf, start, end):
+                    line = buf.rfind(b'\n', start, res.start()) + 1
+                    if line != last_line:
+                        events.append((line, kind, res.group(0)))
+                        last_line = line
+
+            for line, kind, match in sorted(events):
+                if kind == 0:
+                    result.current_slide = decode(match[4:])
+                    result.slides.add(result.current_slide)
+                else:
+                    result.completed.append(result.current_slide)
+
+            self.bytes_read += end - start
+            result.offset = end
+        finally:
+            buf.close()
+        return result
+
+    def scan_text(self, text_file):
+        """
+        Return the computer name recorded in an instance's text file.
+
+        """
+
+        with open(text_file, 'r') as fp:
+            return self.scan_text_lines(fp)
+
+    def scan_text_lines(self, lines):
+        """
+        Return the computer name found in an iterable of text file lines.
+
+        """
+
+        for line in lines:
+            if isinstance(line, bytes):
+                line = decode(line)
+            res = COMP_REGEXP.search(line)
+            if res:
+                return res.group(0)[-8:]
+        return None
@@ -0,0 +1,80 @@
+import argparse
+import os
+import re
+from database import session
+from models import Session
+
+SESS_REGEXP = re.compile('[\w]+_[1-5]{1}')
+
+# replace this with the proper root directory containing the
+# session directories
+DATA_DIR = ''
+
+# get slide count from session .csv file
+def count_slides(csv_file):
+    slides = []
+    with open(csv_file, 'r') as fp:
+        for line in fp:
+            if line.count(',') < 4: continue
+            line = line.strip().split(',')
+            if line[4] != '' and line[4] != 'Slide':
+                slides.append(line[4])
+    return len(slides)
+
+def compile_slide_counts(data_dir):
+    """
+    Return a dict of the slide count of each session directory below
+    data_dir.
+
+    """
+
+    data_dir = os.path.join(data_dir, '')
+    slide_count = {}
+    for item in sorted(os.listdir(data_dir)):
+        if SESS_REGEXP.match(item):
+            phx_dir = data_dir + item + '/phoenix/'
+            csv_file = phx_dir + item + '.csv'
+
+            if os.path.isdir(phx_dir) and os.path.isfile(csv_file):
+                slide_count[item] = count_slides(csv_file)
+            elif os.path.isdir(phx_dir) and not os.path.isfile(csv_file):
+                slide_count[item] = 0
+    return slide_count
+
+def refresh_slide_counts(data_dir):
+    """
+    Update the slide count of each session in the database from its
+    .csv file, returning the number of sessions changed.
+
+    """
+
+    slide_count = compile_slide_counts(data_dir)
+
+    changed = 0
+    sessions = session.query(Session).all()
+    for item in sessions:
+        if item.name not in slide_count.keys(): continue
+        if int(item.slides) != int(slide_count[item.name]):
+            item.slides = int(slide_count[item.name])
+            session.add(item)
+            changed += 1
+    session.commit()
+    return changed
+
+def main(argv=None, prog=None):
+    """
+    Refresh the session slide counts with command line arguments.
+
+    """
+
+    parser = argparse.ArgumentParser(prog=prog,
+            description='Update session slide counts from the session .csv files.')
+    parser.add_argument('data_dir', nargs='?', default=DATA_DIR,
+            help='root directory containing the session directories')
+    args = parser.parse_args(argv)
+
+    changed = refresh_slide_counts(args.data_dir)
+    print('%d session slide counts updated' % changed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+
+class SQLiteStore(object):
+    '''
+    Class representing a table in a local SQLite database, used to keep
+    processor state between runs.
+
+    '''
+
+    SCHEMA = None
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._conn = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pid'] = None
+        return state
+
+    @property
+    def connection(self):
+        # sqlite connections must not be shared with forked workers
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.filename, timeout=30)
+            self._conn.execute(self.SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+class FingerprintStore(SQLiteStore):
+    '''
+    Class representing a local SQLite database that maps each log file
+    to the stat fingerprint of its instance and the GUID computed for it.
+
+    '''
+
+    SCHEMA = 'CREATE TABLE IF NOT EXISTS fingerprints (' \
+             'path TEXT PRIMARY KEY, ' \
+             'fingerprint TEXT NOT NULL, ' \
+             'guid TEXT NOT NULL)'
+
+    def lookup(self, path, fingerprint):
+        """
+        Return the GUID previously stored for a path if its fingerprint
+        is unchanged, otherwise None.
+
+        """
+
+        row = self.connection.execute(
+                'SELECT fingerprint, guid FROM fingerprints WHERE path = ?',
+                (path,)).fetchone()
+        if row is None or row[0] != fingerprint:
+            return None
+        return row[1]
+
+    def record(self, entries):
+        """
+        Store a list of (path, fingerprint, guid) tuples.
+
+        """
+
+        if not entries:
+            return
+        with self.connection:
+            self.connection.executemany(
+                    'INSERT OR REPLACE INTO fingerprints '
+                    '(path, fingerprint, guid) VALUES (?, ?, ?)',
+                    entries)
+
+class CheckpointStore(SQLiteStore):
+    '''
+    Class representing a local SQLite database that holds the partial
+    scan state of log files that are still being written.
+
+    '''
+
+    SCHEMA = 'CREATE TABLE IF NOT EXISTS checkpoints (' \
+             'path TEXT PRIMARY KEY, ' \
+             'state TEXT NOT NULL)'
+
+    def load(self, path):
+        """
+        Return the saved state dict for a log file, or None.
+
+        """
+
+        row = self.connection.execute(
+                'SELECT state FROM checkpoints WHERE path = ?',
+                (path,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def save(self, path, state):
+        """
+        Save the state dict for a log file.
+
+        """
+
+        with self.connection:
+            self.connection.execute(
+                    'INSERT OR REPLACE INTO checkpoints (path, state) '
+                    'VALUES (?, ?)',
+                    (path, json.dumps(state, separators=(',', ':'))))
+
+    def discard(self, paths):
+        """
+        Remove the checkpoints of log files that have been ingested.
+
+        """
+
+        if not paths:
+            return
+        with self.connection:
+            self.connection.executemany(
+                    'DELETE FROM checkpoints WHERE path = ?',
+                    [(path,) for path in paths])
+
+class ManifestStore(SQLiteStore):
+    '''
+    Class representing a local SQLite database that maps each mirrored
+    file to the size and mtime it had on the remote host when it was
+    copied.
+
+    '''
+
+    SCHEMA = 'CREATE TABLE IF NOT EXISTS manifest (' \
+             'path TEXT PRIMARY KEY, ' \
+             'size INTEGER NOT NULL, ' \
+             'mtime INTEGER NOT NULL)'
+
+    def load(self):
+        """
+        Return a dict mapping each path to its (size, mtime).
+
+        """
+
+        rows = self.connection.execute('SELECT path, size, mtime FROM manifest')
+        return dict((path, (size, mtime)) for path, size, mtime in rows)
+
+    def record(self, entries):
+        """
+        Store a list of (path, size, mtime) tuples.
+
+        """
+
+        if not entries:
+            return
+        with self.connection:
+            self.connection.executemany(
+                    'INSERT OR REPLACE INTO manifest '
+                    '(path, size, mtime) VALUES (?, ?, ?)',
+                    entries)
+
+def stat_fingerprint(instance_files):
+    """
+    Return a string built from the (size, mtime, inode) of every file
+    that contributes to an instance hash, without reading any of them.
+
+    """
+
+    def entry(path, name):
+        st = os.stat(path)
+        return [name, st.st_size, st.st_mtime, st.st_ino]
+
+    instance_dir = instance_files[0]
+    entries = []
+    if os.path.isdir(instance_dir):
+        for path, dirs, files in os.walk(instance_dir):
+            rel = os.path.relpath(path, instance_dir)
+            dirs.sort()
+            for item in dirs:
+                entries.append(entry(os.path.join(path, item),
+                                     os.path.normpath(os.path.join(rel, item))))
+            for item in sorted(files):
+                entries.append(entry(os.path.join(path, item),
+                                     os.path.normpath(os.path.join(rel, item))))
+    for path in instance_files[1:]:
+        if os.path.isfile(path):
+            entries.append(entry(path, path))
+    return json.dumps(entries, separators=(',', ':'))
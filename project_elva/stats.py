@@ -1,7 +1,9 @@
+import argparse
 import json
+import os
 import re
 from datetime import datetime
-from tqdm import *
+from tqdm import tqdm
 
 # ---------------------------------
 # DB config
@@ -13,23 +15,8 @@ from models import (Base,
         Student, Teacher,
         Unit
 )
-from sqlalchemy import create_engine
+from database import session
 from sqlalchemy import MetaData
-from sqlalchemy.engine.url import URL
-from sqlalchemy.orm import sessionmaker
-
-db_url = {
-        'drivername': 'postgresql',
-        'database': os.environ['POSTGRES_DB'], 
-        'username': os.environ['POSTGRES_USER'],
-        'password': os.environ['POSTGRES_PASSWORD'],
-        'host': 'localhost',
-        'port': 5432
-}
-engine = create_engine(URL(**db_url))
-
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
 
 # ---------------------------------
 # XLSX output config 
@@ -623,7 +610,35 @@ def get_data():
 
     return sheet
 
-if __name__ == "__main__":
+def dump_json(data, filename):
+    """
+    Write the data collected by get_data() to a JSON file.
+
+    """
+
+    with open(filename, 'w') as fp:
+        json.dump(data, fp, sort_keys=True, indent=4, separators=[', ', ': '])
+
+def main(argv=None, prog=None):
+    """
+    Write the stats spreadsheet and its JSON dump.
+
+    """
+
+    parser = argparse.ArgumentParser(prog=prog,
+            description='Write the ELVA stats spreadsheet and JSON dump.')
+    parser.add_argument('--output-dir', default='.',
+            help='directory the Stats_<date> files are written to')
+    parser.add_argument('--no-json', action='store_true',
+            help='only write the spreadsheet')
+    args = parser.parse_args(argv)
+
+    # one query serves both files; the JSON is written first because
+    # the spreadsheet writer works through the same dict
+    data = get_data()
+    basename = os.path.join(args.output_dir, 'Stats_' + DATESTRING)
+    if not args.no_json:
+        dump_json(data, basename + '.json')
 
     writer = ExcelWriter(session)
 
@@ -633,12 +648,10 @@ if __name__ == "__main__":
     ws1.freeze_panes = 'E3'
 
     writer.create_title_bar(ws1)
-    writer.add_log_data(ws1, log_dict=get_data())
+    writer.add_log_data(ws1, log_dict=data)
     writer.add_legend()
 
-    writer.save('Stats_' + DATESTRING + '.xlsx')
+    writer.save(basename + '.xlsx')
 
-# dump data to JSON format
-d = get_data()
-with open('Stats_'+DATESTRING+'.json', 'w') as fp:
-    json.dump(d, fp, sort_keys=True, indent=4, separators=[', ', ': '])
+if __name__ == "__main__":
+    main()
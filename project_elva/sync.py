@@ -0,0 +1,345 @@
+import argparse
+import os
+import posixpath
+import stat
+import sys
+import threading
+from discovery import PART_SUFFIX
+from eventlog import EventLogger, start_logging
+from metrics import Metrics
+from multiprocessing.pool import ThreadPool
+from state import ManifestStore
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+##################
+# Logging
+##################
+
+LOG_FILENAME = '/home/elva/data-processing/log/log-sync.log'
+
+proc_logger = EventLogger('proc-logger')
+
+##################
+# Miscellaneous
+##################
+
+# password of the remote user, if a key is not used; it is only read
+# from the environment, so it stays out of the process list
+PASSWORD_ENV = 'ELVA_SFTP_PASSWORD'
+
+# the manifest is kept next to the mirror, not inside the tree ingested
+MANIFEST_SUFFIX = '.sync-manifest.db'
+READ_SIZE = 256*1024
+
+def parse_remote(remote):
+    """
+    Split a [user@]host:path remote into its user, host and path.
+
+    """
+
+    if ':' not in remote:
+        raise ValueError('remote must be of the form [user@]host:path')
+    host, path = remote.split(':', 1)
+    username = None
+    if '@' in host:
+        username, host = host.rsplit('@', 1)
+    return username, host, path or '.'
+
+class Mirror(object):
+    '''
+    Class that mirrors a remote log tree to a local directory over
+    SFTP. Directories are listed and files fetched by a pool of threads,
+    each with its own SFTP channel on one SSH connection. A manifest of
+    the size and mtime of every file copied means only new or changed
+    files are transferred, and a transfer that is cut short resumes
+    from its .part file on the next run.
+
+    Log and audio files are only ever appended to, so a .part file
+    shorter than the remote file is taken to be a prefix of it. Files
+    ending in .part are ignored by ingestion.
+
+    '''
+
+    def __init__(self, host, remote_root, local_root, manifest,
+                 port=22, username=None, password=None, key_filename=None,
+                 known_hosts=None, channels=4, metrics=None):
+        if paramiko is None:
+            raise ImportError('sync requires paramiko')
+
+        self.channels = channels
+        self.host = host
+        self.key_filename = key_filename
+        self.known_hosts = known_hosts
+        self.local_root = local_root
+        self.manifest = manifest
+        self.metrics = metrics or Metrics()
+        self.password = password
+        self.port = port
+        self.remote_root = remote_root
+        self.username = username
+        self._clients = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ssh = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        self._ssh = paramiko.SSHClient()
+        self._ssh.load_system_host_keys()
+        if self.known_hosts is not None:
+            self._ssh.load_host_keys(self.known_hosts)
+        self._ssh.connect(self.host,
+                port=self.port,
+                username=self.username,
+                password=self.password,
+                key_filename=self.key_filename)
+
+    def close(self):
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+        if self._ssh is not None:
+            self._ssh.close()
+            self._ssh = None
+        self._local = threading.local()
+
+    def sftp(self):
+        """
+        Return the SFTP channel of the calling thread, opening it on
+        first use.
+
+        """
+
+        client = getattr(self._local, 'sftp', None)
+        if client is None:
+            client = self._ssh.open_sftp()
+            self._local.sftp = client
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    def local_path(self, path):
+        return os.path.join(self.local_root, *path.split('/'))
+
+    def listdir(self, path):
+        """
+        Return the (path, size, mtime) of the files in a remote
+        directory and the paths of its subdirectories, relative to the
+        remote root.
+
+        """
+
+        files = []
+        dirs = []
+        for attr in self.sftp().listdir_attr(posixpath.join(self.remote_root, path)):
+            item = posixpath.join(path, attr.filename) if path else attr.filename
+            if stat.S_ISDIR(attr.st_mode):
+                dirs.append(item)
+            elif stat.S_ISREG(attr.st_mode):
+                files.append((item, attr.st_size, int(attr.st_mtime)))
+        return files, dirs
+
+    def walk(self, pool):
+        """
+        Yield the (path, size, mtime) of every remote file, listing
+        each level of the tree in parallel.
+
+        """
+
+        level = ['']
+        while level:
+            next_level = []
+            for files, dirs in pool.imap_unordered(self.listdir, level):
+                for item in files:
+                    yield item
+                next_level.extend(dirs)
+            level = sorted(next_level)
+
+    def fetch(self, entry):
+        """
+        Copy one remote file to the local tree, resuming from its .part
+        file if there is one. Return the entry and the number of bytes
+        transferred, or None for the bytes if the copy failed.
+
+        """
+
+        path, size, mtime = entry
+        local = self.local_path(path)
+        part = local + PART_SUFFIX
+        try:
+            local_dir = os.path.dirname(local)
+            if not os.path.isdir(local_dir):
+                try:
+                    os.makedirs(local_dir)
+                except OSError:
+                    # another thread created it first
+                    if not os.path.isdir(local_dir):
+                        raise
+
+            offset = 0
+            if os.path.isfile(part):
+                offset = os.path.getsize(part)
+                if offset > size:
+                    offset = 0
+
+            with self.sftp().open(posixpath.join(self.remote_root, path), 'rb') as remote:
+                with open(part, 'ab' if offset else 'wb') as fp:
+                    remote.seek(offset)
+                    remote.prefetch(size)
+                    # stop at the listed size, so a log still being
+                    # written matches the manifest entry recorded for it
+                    remaining = size - offset
+                    while remaining > 0:
+                        data = remote.read(min(READ_SIZE, remaining))
+                        if not data:
+                            break
+                        fp.write(data)
+                        remaining -= len(data)
+
+            if os.path.getsize(part) != size:
+                raise IOError('%s changed size during the transfer' % path)
+            os.utime(part, (mtime, mtime))
+            os.rename(part, local)
+        except (IOError, OSError) as e:
+            proc_logger.error('sync_failed', path, 'failed to copy %s - %s', path, str(e))
+            return entry, None
+
+        proc_logger.debug('file_synced', path, 'copied %d of %d bytes', size - offset, size)
+        return entry, size - offset
+
+    def changed(self, files, rescan=False):
+        """
+        Return the files whose size or mtime differs from the manifest,
+        or from the local copy if rescan is set.
+
+        """
+
+        changed = []
+        if rescan:
+            for path, size, mtime in files:
+                try:
+                    st = os.stat(self.local_path(path))
+                except OSError:
+                    changed.append((path, size, mtime))
+                    continue
+                if (st.st_size, int(st.st_mtime)) != (size, mtime):
+                    changed.append((path, size, mtime))
+            return changed
+
+        copied = self.manifest.load()
+        return [(path, size, mtime) for path, size, mtime in files
+                if copied.get(path) != (size, mtime)]
+
+    def run(self, rescan=False, batch_size=500):
+        """
+        Mirror the remote tree and return the number of files copied,
+        left unchanged and failed.
+
+        """
+
+        pool = ThreadPool(self.channels)
+        try:
+            with self.metrics.timer('sync_list'):
+                files = list(self.walk(pool))
+            changed = self.changed(files, rescan)
+            unchanged = len(files) - len(changed)
+            if rescan:
+                # files already in place still need their manifest entry
+                changed_paths = set(path for path, size, mtime in changed)
+                for start in range(0, len(files), batch_size):
+                    self.manifest.record([item for item in files[start:start+batch_size]
+                                          if item[0] not in changed_paths])
+
+            copied = 0
+            failed = 0
+            pending = []
+            # the largest files first, so one big log does not finish last
+            changed.sort(key=lambda item: item[1], reverse=True)
+            with self.metrics.timer('sync_fetch'):
+                for entry, transferred in pool.imap_unordered(self.fetch, changed):
+                    if transferred is None:
+                        failed += 1
+                        continue
+                    self.metrics.count('bytes_synced', transferred)
+                    copied += 1
+                    # the manifest is only written from this thread
+                    pending.append(entry)
+                    if len(pending) >= batch_size:
+                        self.manifest.record(pending)
+                        pending = []
+            self.manifest.record(pending)
+
+            self.metrics.count('files_synced', copied)
+            self.metrics.count('files_unchanged', unchanged)
+            self.metrics.count('files_failed', failed)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return copied, unchanged, failed
+
+def main(argv=None, prog=None):
+    """
+    Mirror the remote log tree with command line arguments.
+
+    """
+
+    parser = argparse.ArgumentParser(prog=prog,
+            description='Mirror the remote ELVA log tree to a local directory over SFTP, '
+                        'copying only new or changed files.')
+    parser.add_argument('remote', help='[user@]host:path of the remote log tree')
+    parser.add_argument('local_dir', help='local directory to mirror into')
+    parser.add_argument('--port', type=int, default=22)
+    parser.add_argument('--key-file', help='private key used to log in')
+    parser.add_argument('--known-hosts',
+            help='known_hosts file to check the host key against, '
+                 'in addition to ~/.ssh/known_hosts')
+    parser.add_argument('--channels', type=int, default=4,
+            help='number of SFTP channels used at once')
+    parser.add_argument('--manifest',
+            help='SQLite file recording the files copied '
+                 '(default: the local directory name followed by %s)' % MANIFEST_SUFFIX)
+    parser.add_argument('--rescan', action='store_true',
+            help='compare against the local files instead of the manifest, '
+                 'e.g. to adopt an existing copy of the tree')
+    args = parser.parse_args(argv)
+    start_logging('proc-logger', LOG_FILENAME)
+
+    try:
+        username, host, remote_root = parse_remote(args.remote)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not os.path.isdir(args.local_dir):
+        os.makedirs(args.local_dir)
+    manifest = ManifestStore(args.manifest or
+                             os.path.normpath(args.local_dir) + MANIFEST_SUFFIX)
+
+    mirror = Mirror(host, remote_root, args.local_dir, manifest,
+            port=args.port,
+            username=username,
+            password=os.environ.get(PASSWORD_ENV),
+            key_filename=args.key_file,
+            known_hosts=args.known_hosts,
+            channels=args.channels)
+    with mirror:
+        copied, unchanged, failed = mirror.run(rescan=args.rescan)
+    print('%d files copied, %d unchanged, %d failed' % (copied, unchanged, failed))
+    if failed:
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import argparse
+import os
+import random
+import struct
+from datetime import datetime, timedelta
+
+##################
+# Miscellaneous
+##################
+
+SESSION_NAMES = ['CesarChavez', 'EllenOchoa', 'FridaKahlo',
+                 'RobertoClemente', 'SoniaSotomayor']
+START_DATE = datetime(2017, 4, 3, 8, 30, 0)
+
+def au_file(data_size, rng):
+    """
+    Return the bytes of a mono 8 kHz 16-bit linear Sun .au file.
+
+    """
+
+    header = b'.snd' + struct.pack('>5I', 24, data_size, 3, 8000, 1)
+    return header + bytearray(rng.getrandbits(8) for n in range(data_size))
+
+class TreeGenerator(object):
+    '''
+    Class that builds a fake SOURCE_LOG_DIR laid out and formatted the
+    way the regexes in process.py expect.
+
+    '''
+
+    def __init__(self, root, schools=2, students=10, instances=3,
+                 log_lines=500, audio=20, audio_bytes=16000,
+                 null_ratio=0.1, seed=0):
+        self.audio = audio
+        self.audio_bytes = audio_bytes
+        self.instances = instances
+        self.log_lines = log_lines
+        self.null_ratio = null_ratio
+        self.rng = random.Random(seed)
+        self.root = root
+        self.schools = schools
+        self.students = students
+
+        self.session_names = set()
+        self.student_ids = set()
+
+    def generate(self):
+        """
+        Write the tree and return the list of instance paths created.
+
+        """
+
+        paths = []
+        student_id = 100000
+        for school in range(self.schools):
+            school_dir = os.path.join(self.root, 'School%02d' % (school+1))
+            for student in range(self.students):
+                student_id += 1
+                self.student_ids.add(student_id)
+                computer = '%02d-%05d' % (school+1, self.rng.randint(0, 99999))
+                for n in range(self.instances):
+                    paths.append(self.write_instance(school_dir, student_id,
+                                                     computer, n))
+        return paths
+
+    def write_instance(self, school_dir, student_id, computer, n):
+        """
+        Write one instance directory with its .txt and .log files.
+
+        """
+
+        session_name = '%s_%d' % (SESSION_NAMES[n % len(SESSION_NAMES)],
+                                  n // len(SESSION_NAMES) % 9 + 1)
+        self.session_names.add(session_name)
+        start = START_DATE + timedelta(days=self.rng.randint(0, 60),
+                                       minutes=self.rng.randint(0, 300))
+        instance_path = os.path.join(school_dir, '%s_%06d_%s' % (
+                session_name, student_id, start.strftime('%d-%m-%Y')))
+        os.makedirs(instance_path)
+
+        with open(instance_path+'.txt', 'w') as fp:
+            fp.write('ELVA session information\n')
+            fp.write('Computer Name: %s\n' % computer)
+            fp.write('Student ID: %06d\n' % student_id)
+
+        audio = []
+        for m in range(self.audio):
+            name = 'rec_%04d.au' % (m+1)
+            with open(os.path.join(instance_path, name), 'wb') as fp:
+                if self.rng.random() >= self.null_ratio:
+                    fp.write(au_file(self.audio_bytes, self.rng))
+            audio.append(name)
+
+        self.write_log(instance_path+'.log', session_name, start, audio)
+        return instance_path
+
+    def write_log(self, log_file, session_name, start, audio):
+        """
+        Write a log with timestamped slide loads, completions and
+        recordings, padded with continuation lines.
+
+        """
+
+        unit, number = session_name.split('_')
+        events = max(len(audio), self.log_lines // 4)
+        when = start
+        slide = 0
+        pending_audio = list(audio)
+        with open(log_file, 'w') as fp:
+            fp.write('%s INFO Session started\n' % when.strftime('%d/%m/%Y %H:%M:%S'))
+            for n in range(events):
+                when += timedelta(seconds=self.rng.randint(1, 20))
+                stamp = when.strftime('%d/%m/%Y %H:%M:%S')
+                choice = self.rng.random()
+                if pending_audio and choice < 0.4:
+                    fp.write('%s INFO Recording saved: %s\n' % (stamp, pending_audio.pop(0)))
+                elif choice < 0.7:
+                    slide += 1
+                    fp.write('%s INFO Loading XML/ELVA_%s-Session%s_Slide%02d.xml\n' %
+                             (stamp, unit, number, slide))
+                elif choice < 0.85:
+                    fp.write('%s INFO *** SLIDE COMPLETED ***\n' % stamp)
+                else:
+                    fp.write('%s DEBUG frame rendered\n' % stamp)
+                    fp.write('    at elva.ui.Renderer.draw(Renderer.java:%d)\n' %
+                             self.rng.randint(10, 900))
+            for name in pending_audio:
+                when += timedelta(seconds=1)
+                fp.write('%s INFO Recording saved: %s\n' %
+                         (when.strftime('%d/%m/%Y %H:%M:%S'), name))
+            fp.write('%s INFO Session ended\n' %
+                     (when + timedelta(seconds=5)).strftime('%d/%m/%Y %H:%M:%S'))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+            description='Generate a synthetic ELVA log tree.')
+    parser.add_argument('root')
+    parser.add_argument('--schools', type=int, default=2)
+    parser.add_argument('--students', type=int, default=10,
+            help='students per school')
+    parser.add_argument('--instances', type=int, default=3,
+            help='instances per student')
+    parser.add_argument('--log-lines', type=int, default=500)
+    parser.add_argument('--audio', type=int, default=20,
+            help='.au files per instance')
+    parser.add_argument('--audio-bytes', type=int, default=16000)
+    parser.add_argument('--null-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = TreeGenerator(args.root,
+            schools=args.schools,
+            students=args.students,
+            instances=args.instances,
+            log_lines=args.log_lines,
+            audio=args.audio,
+            audio_bytes=args.audio_bytes,
+            null_ratio=args.null_ratio,
+            seed=args.seed)
+    print('%d instances written to %s' % (len(generator.generate()), args.root))
@@ -0,0 +1,249 @@
+from database import insert_ignore
+from eventlog import EventLogger
+from metrics import Metrics
+from models import AudioFile, Instance
+from rollup import refresh_rollups
+from scanner import parse_timestamp
+from sqlalchemy import exc, func, select
+
+proc_logger = EventLogger('proc-logger')
+
+def audio_rows(record, instance_id=None):
+    """
+    Return the audio_files table rows for a record, for the instance
+    with the given id if there is one. Files named in the log but
+    missing from disk get a row with no size.
+
+    """
+
+    files = dict((item[0], item) for item in record.get('audio_files', []))
+    rows = []
+    seen = set()
+    for item in record['audio']:
+        if item in seen:
+            continue
+        seen.add(item)
+        name, is_null, size, duration = files.get(item, (item, False, None, None))
+        row = {
+                'name': name,
+                'is_null': is_null,
+                'size': size,
+                'duration': duration
+        }
+        if instance_id is not None:
+            row['instance_id'] = instance_id
+        rows.append(row)
+    return rows
+
+class BatchWriter(object):
+    '''
+    Class that buffers records produced by Processor.extract() and
+    writes them to the database in batches.
+
+    '''
+
+    def __init__(self, session, roster, batch_size=500, on_commit=None,
+                 metrics=None):
+        self.batch_size = max(1, batch_size)
+        self.metrics = metrics or Metrics()
+        self.on_commit = on_commit
+        self.roster = roster
+        self._pending = []
+        self._session = session
+
+    def add(self, records):
+        """
+        Queue a list of records, flushing once a full batch is pending.
+
+        """
+
+        self._pending.extend(records)
+        if len(self._pending) >= self.batch_size:
+            self.flush(partial=False)
+
+    def flush(self, partial=True):
+        """
+        Write the pending records in batches of batch_size, committing
+        each batch on its own. With partial unset, a final batch that is
+        not full is left pending.
+
+        """
+
+        while len(self._pending) >= self.batch_size or \
+              (partial and self._pending):
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            self.write(batch)
+
+    def write(self, batch):
+        """
+        Write one batch of records and commit.
+
+        """
+
+        # check the whole batch for existing GUIDs in one round trip
+        guids = set(record['guid'] for record in batch)
+        with self.metrics.timer('db_query'):
+            existing = set(guid for (guid,) in
+                           self._session.query(Instance.guid).\
+                                         filter(Instance.guid.in_(guids)))
+
+        seen = []
+        pending = []
+        for record in batch:
+            if record['guid'] in existing:
+                self.duplicate(record)
+                seen.append(record)
+                continue
+
+            existing.add(record['guid'])
+            pending.append((record, self.row(record)))
+
+        try:
+            with self.metrics.timer('db_commit'):
+                inserted = []
+                skipped = []
+                if pending:
+                    ids = self.insert_rows([row for record, row in pending])
+                    for record, row in pending:
+                        if record['guid'] in ids:
+                            inserted.append((record, row))
+                        else:
+                            skipped.append(record)
+                    self.insert_audio([record for record, row in inserted], ids)
+                    refresh_rollups(self._session, self.keys(row for record, row in inserted))
+                self._session.commit()
+            inserted = [record for record, row in inserted]
+        except exc.SQLAlchemyError:
+            self._session.rollback()
+            with self.metrics.timer('db_commit'):
+                inserted, skipped = self.insert_each(pending)
+        self.metrics.count('instances_added', len(inserted))
+
+        # rows another writer added since the GUID query above
+        for record in skipped:
+            self.duplicate(record)
+        for record in inserted:
+            proc_logger.info('instance_added', record['instance_path'].split('/')[-1],
+                    'successfully added instance')
+
+        if self.on_commit is not None:
+            self.on_commit(seen + skipped + inserted)
+
+    def duplicate(self, record):
+        """
+        Count and log a record whose GUID is already in the database.
+
+        """
+
+        self.metrics.count('instances_duplicated')
+        proc_logger.warning('instance_duplicate', record['instance_path'].split('/')[-1],
+                'attempted to add instance with same GUID %s', record['guid'])
+
+    def insert_each(self, pending):
+        """
+        Insert rows one at a time, each in its own transaction, so that
+        a single bad row does not lose the rest of the batch. Return the
+        records inserted and the records skipped because their GUID was
+        already taken.
+
+        """
+
+        inserted = []
+        skipped = []
+        for record, row in pending:
+            # not SAVEPOINTs, which python 2's sqlite3 module breaks
+            try:
+                ids = self.insert_rows([row])
+                if ids:
+                    self.insert_audio([record], ids)
+                    refresh_rollups(self._session, self.keys([row]))
+                self._session.commit()
+            except exc.SQLAlchemyError as e:
+                self._session.rollback()
+                proc_logger.error('insert_failed', record['instance_path'].split('/')[-1],
+                        'failed to insert instance - %s', str(e).split('\n')[0])
+                continue
+            if ids:
+                inserted.append(record)
+            else:
+                skipped.append(record)
+        return inserted, skipped
+
+    def insert_rows(self, rows):
+        """
+        Insert instances table rows, skipping any whose GUID is already
+        taken, e.g. by a concurrent ingest. Return a dict mapping the
+        GUID of each row actually inserted to its new id.
+
+        """
+
+        table = Instance.__table__
+        if self._session.get_bind().dialect.name == 'postgresql':
+            # ON CONFLICT DO NOTHING only returns the rows it inserted
+            result = self._session.execute(self.insert().\
+                                           values(rows).\
+                                           returning(table.c.guid, table.c.id))
+            return dict((guid, id) for guid, id in result)
+
+        result = self._session.execute(self.insert().\
+                                       values(rows))
+        if not result.rowcount:
+            return {}
+        # sqlite counts only the rows ON CONFLICT DO NOTHING inserted, and
+        # holds the write lock while giving them the next ids in turn,
+        # so they are the last rowcount ids of the table
+        last_id = self._session.execute(select([func.max(table.c.id)])).scalar()
+        return dict(self._session.query(Instance.guid, Instance.id).\
+                                  filter(Instance.id > last_id - result.rowcount))
+
+    def insert_audio(self, records, ids):
+        """
+        Write the audio_files rows of newly inserted records in one
+        batch, for the instance ids returned by insert_rows().
+
+        """
+
+        rows = []
+        for record in records:
+            rows.extend(audio_rows(record, ids[record['guid']]))
+        if rows:
+            self._session.execute(AudioFile.__table__.insert(), rows)
+
+    def keys(self, rows):
+        """
+        Return the (student_id, session_id) rollup keys of a list of
+        instances table rows.
+
+        """
+
+        return set((row['student_id'], row['session_id']) for row in rows)
+
+    def insert(self):
+        """
+        Return an INSERT into the instances table that skips rows whose
+        GUID is already stored, on the session's database.
+
+        """
+
+        return insert_ignore(Instance.__table__,
+                             self._session.get_bind().dialect.name, ['guid'])
+
+    def row(self, record):
+        """
+        Return the instances table row for a record.
+
+        """
+
+        return {
+                'guid': record['guid'],
+                'computer': record['computer'],
+                'student_id': int(record['student_id']),
+                'session_id': self.roster.session_id(record['session_name']),
+                'start_time': parse_timestamp(record['start_time']),
+                'end_time': parse_timestamp(record['end_time']),
+                'null_audio_count': len(record['null_audio']),
+                'total_audio_count': len(record['audio']),
+                'slides_finished': len(record['slides']),
+                'audio_files': record['audio']
+        }
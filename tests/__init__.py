@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the project_elva modules import each other as top-level modules
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'project_elva')
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+from database import make_engine
+from db_init import SeedLoader, init_db
+from models import Base, Computer, Instance, School, Session, Student
+from sqlalchemy.orm import sessionmaker
+
+SEED_FILES = {
+        'computers.csv': '#guid\n'
+                         'C-1\n'
+                         '  # retired machines\n'
+                         '\n'
+                         'C-2\n',
+        'schools.csv': '#id,name\n'
+                       '1,Alpha School\n',
+        'units.csv': '# units\n'
+                     'UnitA\n',
+        'teachers.csv': '#id,name,school\n'
+                        '10,T One,Alpha School\n',
+        'students.csv': '#id,name,computer,teacher\n'
+                        '100,S One,C-1,10\n'
+                        '#101,S Two,C-2,10\n',
+        'sessions.csv': '#,name,slides\n'
+                        'UnitA,Sess1,12\n',
+        'sample-instances.csv': '#guid,student,session,start,end,null,total,slides,audio\n'
+                                'g-1,100,Sess1,01/02/2020 10:00:00,01/02/2020 10:30:00,'
+                                '1,3,12,|a.au|b.au|c.au|\n'
+}
+
+class SeedLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='elva-test-')
+        for filename, text in SEED_FILES.items():
+            with open(os.path.join(self.temp_dir, filename), 'w') as fp:
+                fp.write(text)
+        self.engine = make_engine('sqlite:///' + os.path.join(self.temp_dir, 'elva.db'))
+        Base.metadata.create_all(bind=self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.temp_dir)
+
+    def test_comment_rows_skipped(self):
+        SeedLoader(self.session, self.temp_dir).load()
+
+        self.assertEqual(sorted(guid for (guid,) in self.session.query(Computer.guid)),
+                         ['C-1', 'C-2'])
+        self.assertEqual(self.session.query(School.name).all(), [('Alpha School',)])
+        self.assertEqual(self.session.query(Student.id).all(), [(100,)])
+        self.assertEqual(self.session.query(Session.name).all(), [('Sess1',)])
+        self.assertEqual(self.session.query(Instance.audio_files).one(),
+                         (['a.au', 'b.au', 'c.au'],))
+
+    def test_load_twice_unchanged(self):
+        first = SeedLoader(self.session, self.temp_dir).load()
+        second = SeedLoader(self.session, self.temp_dir).load()
+
+        self.assertEqual([(table, inserted) for table, inserted, updated in first],
+                         [('computers', 2), ('schools', 1), ('units', 1), ('teachers', 1),
+                          ('students', 1), ('sessions', 1), ('instances', 1)])
+        self.assertEqual([inserted for table, inserted, updated in second], [0] * 7)
+        self.assertEqual(self.session.query(Computer).count(), 2)
+
+    def test_short_row_reported(self):
+        with open(os.path.join(self.temp_dir, 'schools.csv'), 'a') as fp:
+            fp.write('2\n')
+        loader = SeedLoader(self.session, self.temp_dir)
+        with self.assertRaises(ValueError) as context:
+            loader.load(['schools'])
+        self.assertIn('schools.csv line 3', str(context.exception))
+
+    def test_recreate_keeps_ingested_tables(self):
+        with self.assertRaises(ValueError) as context:
+            init_db(self.temp_dir, recreate=['units'])
+        for table_name in ['instances', 'audio_files', 'rollups']:
+            self.assertIn(table_name, str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from hashing import HashEngine
+from synth import TreeGenerator
+
+BUFFER_SIZE = 65536
+
+# the GUID computation as the processor has always done it
+
+def baseline_hash_file(file_path):
+    hash_sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(BUFFER_SIZE), b""):
+            hash_sha1.update(chunk)
+    return hash_sha1.hexdigest()
+
+def baseline_hash_dir(dir_path):
+    file_hashes = []
+    for path, dirs, files in os.walk(dir_path):
+        for item in sorted(files):
+            file_hashes.append(baseline_hash_file(os.path.join(path, item)))
+        for item in sorted(dirs):
+            file_hashes.append(baseline_hash_dir(os.path.join(path, item)))
+        break
+    return str(hashlib.sha1(''.join(file_hashes).encode('ascii')).hexdigest())
+
+def baseline_hash_instance(instance_files):
+    hash_list = []
+    if os.path.isdir(instance_files[0]):
+        hash_list.append(baseline_hash_dir(instance_files[0]))
+    if os.path.isfile(instance_files[1]):
+        hash_list.append(baseline_hash_file(instance_files[1]))
+    if os.path.isfile(instance_files[2]):
+        hash_list.append(baseline_hash_file(instance_files[2]))
+    return str(hashlib.sha1(''.join(hash_list).encode('ascii')).hexdigest())
+
+class HashEngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp(prefix='elva-test-')
+        cls.instances = TreeGenerator(cls.temp_dir, schools=1, students=2,
+                instances=2, log_lines=80, audio=6, audio_bytes=2000,
+                null_ratio=0.3).generate()
+
+        # a nested directory and a missing .txt
+        nested = os.path.join(cls.instances[0], 'extra')
+        os.makedirs(nested)
+        with open(os.path.join(nested, 'notes.dat'), 'wb') as fp:
+            fp.write(b'\0' * 100)
+        os.remove(cls.instances[1]+'.txt')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def instance_files(self):
+        return [[path, path+'.log', path+'.txt'] for path in self.instances]
+
+    def test_sha1_guids_match_baseline(self):
+        expected = [baseline_hash_instance(files) for files in self.instance_files()]
+        # serial and threaded, with and without mmap reads
+        for threads, mmap_threshold in [(1, 1 << 30), (4, 1 << 30), (4, 1)]:
+            engine = HashEngine('sha1', threads=threads, mmap_threshold=mmap_threshold)
+            try:
+                self.assertEqual([engine.hash_instance(files)
+                                  for files in self.instance_files()], expected)
+            finally:
+                engine.close()
+
+    def test_bytes_read(self):
+        engine = HashEngine('sha1', threads=1)
+        files = self.instance_files()[0]
+        engine.hash_instance(files)
+        total = sum(os.path.getsize(os.path.join(path, item))
+                    for path, dirs, names in os.walk(files[0]) for item in names)
+        total += os.path.getsize(files[1]) + os.path.getsize(files[2])
+        self.assertEqual(engine.bytes_read, total)
+
+if __name__ == '__main__':
+    unittest.main()
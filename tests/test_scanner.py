@@ -0,0 +1,109 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from scanner import LogScan, LogScanner
+from synth import TreeGenerator
+
+# the line-by-line parsing the processor used before LogScanner
+
+AUDIO_REGEXP = re.compile('.*\.au')
+TIMESTAMP_REGEXP = re.compile('[\d]{2}\/[\d]{2}\/[\d]{4}\s[\d]{2}:[\d]{2}:[\d]{2}')
+XML_LOAD_REGEXP = re.compile('XML\/ELVA_[\w]+-[\w]+_[\w]+\.xml')
+
+def baseline_parse(log_file):
+    """
+    Return the audio files, sorted slides and (start, end) timestamps of
+    a log, as the old get_audio, get_slides and get_times found them.
+
+    """
+
+    audio = []
+    slides = []
+    timestamps = []
+    with open(log_file, 'r') as fp:
+        for line in fp:
+            res = AUDIO_REGEXP.search(line)
+            if res:
+                audio.append(res.group(0).split()[-1])
+            res = XML_LOAD_REGEXP.search(line)
+            if res:
+                slides.append(res.group(0)[4:])
+            res = TIMESTAMP_REGEXP.match(line)
+            if res:
+                timestamps.append(res.group(0))
+    return audio, sorted(set(slides)), (timestamps[0], timestamps[-1])
+
+def parsed(scan):
+    return scan.audio, sorted(scan.slides), (scan.start_time, scan.end_time)
+
+class LogScannerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp(prefix='elva-test-')
+        instances = TreeGenerator(cls.temp_dir, schools=1, students=2,
+                instances=2, log_lines=400, audio=10, audio_bytes=100).generate()
+        cls.logs = [path+'.log' for path in instances]
+
+        edge = os.path.join(cls.temp_dir, 'edge.log')
+        with open(edge, 'w') as fp:
+            fp.write('header without a timestamp\n')
+            fp.write('01/02/2018 10:00:00 saved a.au b.au\n')
+            fp.write('x XML/ELVA_A-B_C.xml XML/ELVA_D-E_F.xml *** SLIDE COMPLETED ***\n')
+            fp.write('  continuation .au tail\n')
+            fp.write('01/02/2018 10:00:09 XML/ELVA_A-B_C.xml\n')
+            fp.write('02/02/2018 11:00:00 last line without a newline')
+        cls.logs.append(edge)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    def scanners(self):
+        # line by line, and through mmap for any size
+        return [LogScanner(mmap_threshold=0), LogScanner(mmap_threshold=1)]
+
+    def test_scan_matches_baseline(self):
+        for log_file in self.logs:
+            for scanner in self.scanners():
+                self.assertEqual(parsed(scanner.scan(log_file)), baseline_parse(log_file),
+                                 '%s (mmap_threshold %d)' % (log_file, scanner.mmap_threshold))
+
+    def test_checkpoint_resume_matches_baseline(self):
+        grow = os.path.join(self.temp_dir, 'grow.log')
+        for log_file in self.logs:
+            with open(log_file, 'rb') as fp:
+                data = fp.read()
+            # cut mid-line as well as after the first line
+            for cut in [data.index(b'\n') + 1, len(data) // 3, len(data) // 2]:
+                with open(grow, 'wb') as fp:
+                    fp.write(data[:cut])
+                # checkpoints are stored as JSON
+                state = json.dumps(LogScanner().scan(grow, partial=True).to_dict())
+                with open(grow, 'ab') as fp:
+                    fp.write(data[cut:])
+
+                for scanner in self.scanners():
+                    bytes_read = scanner.bytes_read
+                    scan = scanner.scan(grow, resume=LogScan.from_dict(json.loads(state)))
+                    self.assertEqual(parsed(scan), baseline_parse(log_file),
+                                     '%s cut at %d' % (log_file, cut))
+                    self.assertLess(scanner.bytes_read - bytes_read, len(data))
+
+    def test_rewritten_log_scanned_again(self):
+        log_file = os.path.join(self.temp_dir, 'rewritten.log')
+        with open(log_file, 'w') as fp:
+            fp.write('01/02/2018 10:00:00 saved old.au\n')
+        state = LogScanner().scan(log_file, partial=True).to_dict()
+
+        with open(log_file, 'r+') as fp:
+            fp.write('01/02/2018 10:00:00 saved new.au\n')
+            fp.write('01/02/2018 10:00:05 saved more.au\n')
+        scan = LogScanner().scan(log_file, resume=LogScan.from_dict(state))
+        self.assertEqual(parsed(scan), baseline_parse(log_file))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+from database import make_engine
+from metrics import Metrics
+from models import AudioFile, Base, Instance, Rollup, Session, Unit
+from roster import Roster
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from writer import BatchWriter
+
+def make_record(guid, student_id='100001', audio_files=()):
+    return {
+            'guid': guid,
+            'instance_path': '/logs/School01/EllenOchoa_1_%s_06-04-2017' % student_id,
+            'log_file': '/logs/School01/EllenOchoa_1_%s_06-04-2017.log' % student_id,
+            'session_name': 'EllenOchoa_1',
+            'student_id': student_id,
+            'computer': 'ABCD1234',
+            'audio': [name for name, is_null, size, duration in audio_files],
+            'audio_files': list(audio_files),
+            'null_audio': [name for name, is_null, size, duration in audio_files
+                           if is_null],
+            'slides': ['slide1', 'slide2'],
+            'start_time': '06/04/2017 10:00:00',
+            'end_time': '06/04/2017 10:30:00',
+            'fingerprint': ''
+    }
+
+class BatchWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix='elva-test-')
+        self.engine = make_engine('sqlite:///' + os.path.join(self.temp_dir, 'elva.db'))
+        Base.metadata.create_all(bind=self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        unit = Unit(name='EllenOchoa')
+        self.session.add(Session(unit=unit, name='EllenOchoa_1', slides=10))
+        self.session.commit()
+
+        self.committed = []
+        self.metrics = Metrics()
+        self.writer = BatchWriter(self.session, Roster(self.session),
+                batch_size=10,
+                on_commit=self.committed.extend,
+                metrics=self.metrics)
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        shutil.rmtree(self.temp_dir)
+
+    def add_elsewhere(self, guid, student_id):
+        """
+        Insert an instance the way another ingest process would, on a
+        connection of its own.
+
+        """
+
+        with self.engine.begin() as conn:
+            conn.execute(Instance.__table__.insert(),
+                         self.writer.row(make_record(guid, student_id)))
+
+    def test_flush_writes_batch(self):
+        self.writer.add([make_record('guid-a', audio_files=[('a.au', False, 100, 1.5)]),
+                         make_record('guid-b', '100002')])
+        self.writer.flush()
+
+        self.assertEqual(self.session.query(Instance).count(), 2)
+        self.assertEqual(self.session.query(AudioFile).count(), 1)
+        self.assertEqual(self.session.query(Rollup).count(), 2)
+        self.assertEqual(self.metrics.counters['instances_added'], 2)
+        self.assertEqual(sorted(record['guid'] for record in self.committed),
+                         ['guid-a', 'guid-b'])
+
+    def test_large_add_written_in_batches(self):
+        batches = []
+        writer = BatchWriter(self.session, Roster(self.session),
+                batch_size=2,
+                on_commit=batches.append,
+                metrics=self.metrics)
+        writer.add([make_record('guid-%d' % n, str(100001 + n)) for n in range(5)])
+        # full batches are written at once, the short one on flush()
+        self.assertEqual([len(batch) for batch in batches], [2, 2])
+        self.assertEqual(self.session.query(Instance).count(), 4)
+
+        writer.flush()
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(self.metrics.counters['instances_added'], 5)
+
+    def test_missing_audio_stored_without_size(self):
+        record = make_record('guid-a', audio_files=[('a.au', True, 0, None)])
+        record['audio'] = ['a.au', 'gone.au', 'a.au', 'gone.au']
+        self.writer.add([record])
+        self.writer.flush()
+
+        rows = self.session.query(AudioFile.name, AudioFile.is_null, AudioFile.size).\
+                            order_by(AudioFile.id)
+        self.assertEqual(list(rows), [('a.au', True, 0), ('gone.au', False, None)])
+
+    def test_guid_already_stored(self):
+        self.add_elsewhere('guid-a', '100001')
+        self.writer.add([make_record('guid-a'), make_record('guid-a')])
+        self.writer.flush()
+
+        self.assertEqual(self.session.query(Instance).count(), 1)
+        self.assertEqual(self.metrics.counters['instances_duplicated'], 2)
+        self.assertEqual(self.metrics.counters.get('instances_added', 0), 0)
+
+    def test_constraint_violation_not_duplicate(self):
+        row = self.writer.row
+        def bad_row(record):
+            values = row(record)
+            if record['guid'] == 'guid-bad':
+                values['start_time'] = None
+            return values
+        self.writer.row = bad_row
+
+        self.writer.add([make_record('guid-a'), make_record('guid-bad', '100002')])
+        self.writer.flush()
+
+        self.assertEqual([guid for (guid,) in self.session.query(Instance.guid)], ['guid-a'])
+        self.assertEqual(self.metrics.counters['instances_added'], 1)
+        self.assertNotIn('instances_duplicated', self.metrics.counters)
+        # so its fingerprint is not stored and a later run retries it
+        self.assertEqual([record['guid'] for record in self.committed], ['guid-a'])
+
+    def test_guid_taken_during_flush(self):
+        # another ingest stores guid-a after the writer has checked for
+        # existing GUIDs but before its INSERT runs
+        taken = []
+        def before_insert(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT INTO instances') and not taken:
+                taken.append(True)
+                self.add_elsewhere('guid-a', '100003')
+        event.listen(self.engine, 'before_cursor_execute', before_insert)
+
+        self.writer.add([make_record('guid-a', audio_files=[('a.au', False, 100, 1.5)]),
+                         make_record('guid-b', '100002',
+                                     audio_files=[('b.au', True, 0, None)])])
+        self.writer.flush()
+
+        guids = dict(self.session.query(Instance.guid, Instance.student_id))
+        self.assertEqual(guids, {'guid-a': 100003, 'guid-b': 100002})
+        self.assertEqual(self.metrics.counters['instances_added'], 1)
+        self.assertEqual(self.metrics.counters['instances_duplicated'], 1)
+
+        # only the instance written by this writer has audio rows and a rollup
+        names = self.session.query(Instance.guid, AudioFile.name).\
+                             join(AudioFile.instance)
+        self.assertEqual(list(names), [('guid-b', 'b.au')])
+        self.assertEqual([rollup.student_id for rollup in self.session.query(Rollup)],
+                         [100002])
+        # both are in the database, so both fingerprints can be stored
+        self.assertEqual(sorted(record['guid'] for record in self.committed),
+                         ['guid-a', 'guid-b'])
+
+if __name__ == '__main__':
+    unittest.main()